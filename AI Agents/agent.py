@@ -1,4 +1,5 @@
 import tools
+from pipeline import Pipeline
 
 class PdfScorerAgent:
     def __init__(self):
@@ -9,13 +10,21 @@ class PdfScorerAgent:
         """Execute the given task"""
         return task.run(self)
     
+    def run_stages(self, stages):
+        """Run a task's stage graph, overlapping independent stages"""
+        return Pipeline(stages).run()
+    
     def download_pdf(self, ipfs_hash):
         """Download PDF from IPFS"""
         return tools.download_pdf_from_ipfs(ipfs_hash)
     
-    def extract_text(self, file_path):
-        """Extract text from PDF"""
-        return tools.extract_text_from_pdf(file_path)
+    def extract_text(self, file_path, max_chars=None):
+        """Extract text from PDF, stopping once max_chars characters are available"""
+        return tools.extract_text_from_pdf(file_path, max_chars)
+    
+    def extract_pages(self, file_path, max_chars=None):
+        """Extract page texts from PDF, stopping once max_chars characters are available"""
+        return tools.extract_pages_from_pdf(file_path, max_chars)
     
     def summarize(self, text):
         """Summarize text"""
@@ -24,3 +33,79 @@ class PdfScorerAgent:
     def score(self, text):
         """Score PDF content"""
         return tools.score_pdf_content(text)
+    
+    def summarize_with_model(self, text):
+        """Summarize text; returns (summary, model that wrote it)"""
+        return tools.summarize_with_model(text)
+    
+    def score_with_model(self, text):
+        """Score PDF content; returns (score, model that gave it)"""
+        return tools.score_with_model(text)
+    
+    def analyze(self, text):
+        """Summarize and score text in a single LLM call"""
+        return tools.analyze_text(text)
+    
+    def analyze_document(self, pages):
+        """Summarize and score a whole document, chunk by chunk if it is long"""
+        return tools.analyze_document(pages)
+    
+    def load_result(self, ipfs_hash, combined=True):
+        """Look up a stored analysis for this document"""
+        return tools.get_cached_result(ipfs_hash, combined)
+    
+    def save_result(self, ipfs_hash, result, model_name, combined=True):
+        """Store an analysis, under the model that produced it, so repeat requests skip the pipeline"""
+        tools.cache_result(ipfs_hash, result, model_name, combined)
+
+    async def arun(self, task):
+        """Execute the given task on the running event loop"""
+        return await task.arun(self)
+    
+    async def arun_stages(self, stages):
+        """Run a task's stage graph of async stages"""
+        return await Pipeline(stages).arun()
+    
+    async def adownload_pdf(self, ipfs_hash):
+        """Download PDF from IPFS without blocking the event loop"""
+        return await tools.adownload_pdf_from_ipfs(ipfs_hash)
+    
+    async def aextract_text(self, file_path, max_chars=None):
+        """Extract text from PDF on an executor thread"""
+        return await tools.aextract_text_from_pdf(file_path, max_chars)
+    
+    async def aextract_pages(self, file_path, max_chars=None):
+        """Extract page texts from PDF on an executor thread"""
+        return await tools.aextract_pages_from_pdf(file_path, max_chars)
+    
+    async def asummarize(self, text):
+        """Summarize text"""
+        return await tools.asummarize_text(text)
+    
+    async def ascore(self, text):
+        """Score PDF content"""
+        return await tools.ascore_pdf_content(text)
+    
+    async def asummarize_with_model(self, text):
+        """Summarize text; returns (summary, model that wrote it)"""
+        return await tools.asummarize_with_model(text)
+    
+    async def ascore_with_model(self, text):
+        """Score PDF content; returns (score, model that gave it)"""
+        return await tools.ascore_with_model(text)
+    
+    async def aanalyze(self, text):
+        """Summarize and score text in a single LLM call"""
+        return await tools.aanalyze_text(text)
+    
+    async def aanalyze_document(self, pages):
+        """Summarize and score a whole document, chunk by chunk if it is long"""
+        return await tools.aanalyze_document(pages)
+    
+    async def aload_result(self, ipfs_hash, combined=True):
+        """Look up a stored analysis for this document"""
+        return await tools.aget_cached_result(ipfs_hash, combined)
+    
+    async def asave_result(self, ipfs_hash, result, model_name, combined=True):
+        """Store an analysis, under the model that produced it, so repeat requests skip the pipeline"""
+        await tools.acache_result(ipfs_hash, result, model_name, combined)
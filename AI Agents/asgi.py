@@ -0,0 +1,446 @@
+"""
+ASGI serving mode for the PDF verification agent and Web3 chatbot.
+
+Serves the same /, /analyze, /api/chat, /api/chat/stream and /health
+contracts as server.py (plus /metrics), but requests are coroutines: IPFS
+downloads and LLM calls are awaited on the event loop, while PDF parsing, the
+caches and SQLite run on a small fixed executor (ASGI_BLOCKING_WORKERS
+threads). One process can then hold hundreds of concurrent requests without a
+thread per request. Batch analysis and background jobs stay on the Flask
+server.
+
+Run with an ASGI server, e.g.: uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import llm
+import metrics
+import server
+import tools
+from agent import PdfScorerAgent
+from singleflight import AsyncSingleFlight
+from task import ScorePdfTask
+from text_format import StreamingCleaner, clean_text_formatting
+
+# Threads for blocking work (PDF parsing, caches, SQLite); independent of the number of requests
+BLOCKING_WORKERS = int(os.getenv("ASGI_BLOCKING_WORKERS", "8"))
+
+# Request bodies are small JSON documents
+MAX_BODY_BYTES = 1024 * 1024
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+# Concurrent analyses of one document, keyed by (CID, force_refresh)
+analysis_flight = AsyncSingleFlight()
+
+_executor_loop = None
+
+
+def use_executor():
+    """Give the running loop a fixed-size default executor, so run_in_executor(None, ...) uses it
+
+    The loop shuts its default executor down when it closes, so each loop gets its own.
+    """
+    global _executor_loop
+    loop = asyncio.get_running_loop()
+    if _executor_loop is not loop:
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="asgi-blocking"))
+        _executor_loop = loop
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+        self.body = body
+
+    def json(self):
+        """Parsed JSON body, or None if it is missing or invalid"""
+        try:
+            return json.loads(self.body.decode("utf-8")) if self.body else None
+        except ValueError:
+            return None
+
+
+class Response:
+    def __init__(self, body, status=200, content_type="application/json", headers=()):
+        self.body = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.status = status
+        self.headers = [(b"content-type", content_type.encode("latin-1"))] + [
+            (name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in headers
+        ]
+
+
+class StreamingResponse(Response):
+    """Response whose body is sent piece by piece from an async iterator of strings"""
+
+    def __init__(self, chunks, status=200, content_type="text/event-stream", headers=()):
+        super().__init__(b"", status, content_type, headers)
+        self.chunks = chunks
+
+
+def json_response(body, status=200, headers=()):
+    return Response(json.dumps(body), status, headers=headers)
+
+
+def rate_limited_response(error):
+    return json_response(server.rate_limited_body(error), 429,
+                         headers=[("Retry-After", server.retry_after_header(error))])
+
+
+def api_key_error():
+    return json_response({
+        "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
+        "status": "error"
+    }, 500)
+
+
+async def index(request):
+    """Serve the main web interface"""
+    return Response(server.HTML_TEMPLATE, content_type="text/html; charset=utf-8")
+
+
+async def analyze_document(ipfs_hash, force_refresh):
+    task = ScorePdfTask(ipfs_hash=ipfs_hash, force_refresh=force_refresh)
+    return await PdfScorerAgent().arun(task)
+
+
+async def analyze_pdf(request):
+    """Analyze a PDF from its IPFS hash (same contract as POST /analyze on the Flask server)"""
+    try:
+        if not llm.backend.configured:
+            return api_key_error()
+
+        data = request.json()
+        if not isinstance(data, dict) or 'ipfs_hash' not in data:
+            return json_response({
+                "error": "Missing 'ipfs_hash' in request body",
+                "status": "error"
+            }, 400)
+
+        error = server.ipfs_hash_error(data['ipfs_hash'])
+        if error:
+            return json_response({
+                "error": error,
+                "status": "error"
+            }, 400)
+        ipfs_hash = data['ipfs_hash'].strip()
+
+        force_refresh = server.parse_flag(data.get('force_refresh'))
+        if force_refresh is None:
+            return json_response({
+                "error": "'force_refresh' must be true or false",
+                "status": "error"
+            }, 400)
+        try:
+            result, shared = await analysis_flight.do((ipfs_hash, force_refresh), analyze_document, ipfs_hash, force_refresh)
+        except Exception:
+            server.ANALYSES.inc(outcome="error")
+            raise
+        return json_response(server.analysis_response(ipfs_hash, result, shared))
+
+    except llm.RateLimited as e:
+        return rate_limited_response(e)
+
+    except Exception as e:
+        print(f"Error analyzing PDF: {e}")
+        print(traceback.format_exc())
+        return json_response({
+            "status": "error",
+            "error": str(e),
+            "message": "Failed to analyze PDF. Please check the IPFS hash and try again.",
+            "timestamp": datetime.now().isoformat()
+        }, 500)
+
+
+async def chat(request):
+    """Web3 chatbot (same contract as POST /api/chat on the Flask server)"""
+    started = time.perf_counter()
+    try:
+        if not llm.backend.configured:
+            return api_key_error()
+
+        data = request.json()
+        if not isinstance(data, dict) or 'prompt' not in data:
+            return json_response({
+                "error": "Missing 'prompt' in request body",
+                "status": "error"
+            }, 400)
+
+        prompt = data.get("prompt", "").strip()
+        if not prompt:
+            return json_response({
+                "error": "Prompt cannot be empty",
+                "status": "error"
+            }, 400)
+
+        knowledge = server.knowledge_base.current
+        session = server.chat_sessions.get_or_create(data.get("session_id"))
+
+        cache_key = (knowledge.version, server.normalize_question(prompt))
+        reply = None if session.has_history else server.answer_cache.get(cache_key)
+        cached = reply is not None
+        if not cached:
+            full_prompt = server.build_chat_prompt(prompt, knowledge, session)
+            try:
+                reply = await llm.agenerate(full_prompt)
+            except llm.RateLimited as e:
+                server.observe_chat("chat", "rate_limited", started)
+                return rate_limited_response(e)
+            except Exception as e:
+                server.observe_chat("chat", "error", started)
+                print(f"Chat generation failed: {e}")
+                return json_response({
+                    "error": "Failed to generate response. No working model available.",
+                    "status": "error"
+                }, 500)
+            reply = clean_text_formatting(reply)
+            if not session.has_history:
+                server.answer_cache.set(cache_key, reply)
+
+        server.chat_sessions.record(session, prompt, reply)
+        server.observe_chat("chat", "cached" if cached else "generated", started)
+        return json_response({
+            "reply": reply,
+            "session_id": session.session_id,
+            "status": "success",
+            "cached": cached,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        server.observe_chat("chat", "error", started)
+        print(f"Chat error: {e}")
+        print(traceback.format_exc())
+        return json_response({
+            "error": str(e),
+            "status": "error",
+            "message": "Failed to process chat request.",
+            "timestamp": datetime.now().isoformat()
+        }, 500)
+
+
+async def chat_stream(request):
+    """Streaming chat (same contract as POST /api/chat/stream on the Flask server)"""
+    if not llm.backend.configured:
+        return api_key_error()
+
+    data = request.json()
+    if not isinstance(data, dict) or 'prompt' not in data:
+        return json_response({
+            "error": "Missing 'prompt' in request body",
+            "status": "error"
+        }, 400)
+
+    prompt = str(data.get("prompt", "")).strip()
+    if not prompt:
+        return json_response({
+            "error": "Prompt cannot be empty",
+            "status": "error"
+        }, 400)
+
+    started = time.perf_counter()
+    knowledge = server.knowledge_base.current
+    session = server.chat_sessions.get_or_create(data.get("session_id"))
+    follow_up = session.has_history
+    cache_key = (knowledge.version, server.normalize_question(prompt))
+
+    async def events():
+        cached_reply = None if follow_up else server.answer_cache.get(cache_key)
+        if cached_reply is not None:
+            yield server.sse_event({"delta": cached_reply})
+            try:
+                yield server.sse_event({"reply": cached_reply, "session_id": session.session_id, "cached": True}, event="done")
+            finally:
+                server.observe_chat("chat_stream", "cached", started)
+                server.chat_sessions.record(session, prompt, cached_reply)
+            return
+
+        cleaner = StreamingCleaner()
+        pieces = []
+        chunks = llm.astream(server.build_chat_prompt(prompt, knowledge, session))
+        try:
+            async for chunk in chunks:
+                piece = cleaner.feed(chunk)
+                if piece:
+                    pieces.append(piece)
+                    yield server.sse_event({"delta": piece})
+            piece = cleaner.flush()
+            if piece:
+                pieces.append(piece)
+                yield server.sse_event({"delta": piece})
+        except llm.RateLimited as e:
+            server.observe_chat("chat_stream", "rate_limited", started)
+            yield server.sse_event({"error": str(e), "status": "error", "retry_after": round(e.retry_after)}, event="error")
+            return
+        except Exception as e:
+            server.observe_chat("chat_stream", "error", started)
+            print(f"Chat stream error: {e}")
+            yield server.sse_event({"error": str(e), "status": "error"}, event="error")
+            return
+        finally:
+            # Stop the model's stream if the client went away mid-reply
+            await chunks.aclose()
+
+        reply = "".join(pieces)
+        if not follow_up:
+            server.answer_cache.set(cache_key, reply)
+        try:
+            yield server.sse_event({"reply": reply, "session_id": session.session_id, "cached": False}, event="done")
+        finally:
+            server.observe_chat("chat_stream", "generated", started)
+            server.chat_sessions.record(session, prompt, reply)
+
+    return StreamingResponse(events(), headers=[
+        ("Cache-Control", "no-cache"),
+        # Stop reverse proxies from buffering the stream
+        ("X-Accel-Buffering", "no"),
+    ])
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return json_response(dict(server.health_status(), analysis_coalescing=analysis_flight.stats()))
+
+
+async def metrics_endpoint(request):
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+ROUTES = {
+    "/": {"GET": index},
+    "/analyze": {"POST": analyze_pdf},
+    "/api/chat": {"POST": chat},
+    "/api/chat/stream": {"POST": chat_stream},
+    "/health": {"GET": health_check},
+    "/metrics": {"GET": metrics_endpoint},
+}
+
+
+async def dispatch(request):
+    methods = ROUTES.get(request.path)
+    if methods is None:
+        return json_response({
+            "error": f"Not found: {request.path}",
+            "status": "error",
+            "message": "The ASGI server serves /, /analyze, /api/chat, /api/chat/stream, /health and /metrics; "
+                       "use server.py for batch analysis and jobs."
+        }, 404)
+    if request.method == "OPTIONS":
+        # CORS preflight, answered like flask-cors does for the Flask server
+        return Response(b"", 200, content_type="text/html; charset=utf-8", headers=[
+            ("Access-Control-Allow-Methods", ", ".join(sorted(set(methods) | {"OPTIONS"}))),
+            ("Access-Control-Allow-Headers", request.headers.get("access-control-request-headers", "*")),
+        ])
+    handler = methods.get(request.method)
+    if handler is None:
+        return json_response({"error": f"Method {request.method} not allowed", "status": "error"}, 405,
+                             headers=[("Allow", ", ".join(sorted(methods)))])
+    return await handler(request)
+
+
+async def read_body(receive):
+    """Request body, or None if it exceeds MAX_BODY_BYTES"""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_streaming(response, receive, send):
+    """Send a StreamingResponse as it is produced, stopping if the client disconnects"""
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": response.headers + CORS_HEADERS,
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        async for chunk in response.chunks:
+            if disconnected.done():
+                return
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        await response.chunks.aclose()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            use_executor()
+            await asyncio.get_running_loop().run_in_executor(None, tools.prune_results)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if tools.async_fetcher:
+                await tools.async_fetcher.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    # Servers without lifespan support still get the fixed executor
+    use_executor()
+    started = time.perf_counter()
+    body = await read_body(receive)
+    if body is None:
+        request = Request(scope, b"")
+        response = json_response({"error": "Request body too large", "status": "error"}, 413)
+    else:
+        request = Request(scope, body)
+        response = await dispatch(request)
+
+    endpoint = request.path if request.path in ROUTES else "unmatched"
+    server.HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                method=request.method, status=response.status)
+    if isinstance(response, StreamingResponse):
+        await send_streaming(response, receive, send)
+        return
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": response.headers + CORS_HEADERS + [(b"content-length", str(len(response.body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": response.body})
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("The ASGI server needs an ASGI runner: pip install uvicorn httpx")
+        print("Then start it with: uvicorn asgi:app --host 0.0.0.0 --port 8000")
+    else:
+        print("🚀 Starting AI Services Platform (ASGI) at http://localhost:8000")
+        uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("ASGI_PORT", "8000")))
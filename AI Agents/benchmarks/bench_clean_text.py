@@ -0,0 +1,150 @@
+"""
+Golden-corpus check and micro-benchmark for text_format.clean_text_formatting.
+
+Verifies that the compiled cleaner produces exactly the same output as the
+original multi-pass implementation (kept below as the reference) on the
+golden corpus and on randomly generated markup, that StreamingCleaner
+reproduces the one-shot output however the text is chunked, then times both
+cleaners on long responses.
+
+Usage:
+    python benchmarks/bench_clean_text.py [--fuzz 20000] [--repeat 50]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_format import StreamingCleaner, clean_text_formatting  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clean_text_corpus.json")
+
+
+def reference_clean_text_formatting(text):
+    """The original server.clean_text_formatting, pass for pass"""
+    text = text.replace('\\n\\n', '\n\n')
+    text = text.replace('\\n', '\n')
+    text = text.replace('\\t', ' ')
+    text = text.replace('\\r', '')
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'__(.*?)__', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'_(.*?)_', r'\1', text)
+    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`(.*?)`', r'\1', text)
+    text = re.sub(r'"([^"]*)"', r'\1', text)
+    text = re.sub(r"'([^']*)'", r'\1', text)
+    text = re.sub(r'\\([*_`"\'])', r'\1', text)
+    text = re.sub(r'\n\n(\d+)[:\s]*', r'\n\n\1. ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r'\n\s+\n', '\n\n', text)
+    text = re.sub(r'[ \t]{2,}', ' ', text)
+    text = re.sub(r'\s+([.,:;!?])', r'\1', text)
+    text = re.sub(r'([.,:;!?])\s{2,}', r'\1 ', text)
+    return text.strip()
+
+
+def check_corpus(corpus):
+    failures = 0
+    for index, case in enumerate(corpus):
+        actual = clean_text_formatting(case["input"])
+        if actual != case["expected"]:
+            failures += 1
+            print(f"❌ corpus case {index}: expected {case['expected']!r}, got {actual!r}")
+    print(f"Golden corpus: {len(corpus) - failures}/{len(corpus)} cases match")
+    return failures
+
+
+def check_fuzz(count, seed=1234):
+    """Random strings over the characters the cleaner rewrites"""
+    alphabet = ['*', '**', '_', '__', '`', '```', '"', "'", '\\', '\\n', '\\t', '\\r', '\n', '\n\n',
+                ' ', '  ', '\t', '.', ',', ':', ';', '!', '?', '1', '23', 'a', 'word', 'x y']
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(count):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        if clean_text_formatting(text) != reference_clean_text_formatting(text):
+            failures += 1
+            if failures <= 5:
+                print(f"❌ fuzz mismatch for {text!r}")
+    print(f"Fuzz: {count - failures}/{count} random inputs match the reference")
+    return failures
+
+
+def stream_clean(text, size):
+    cleaner = StreamingCleaner()
+    pieces = [cleaner.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return "".join(pieces) + cleaner.flush(), next((i for i, piece in enumerate(pieces) if piece), None)
+
+
+def check_streaming(corpus, chunk_sizes=(1, 3, 16, 64)):
+    """Streaming cleanup must match one-shot cleanup for every chunking"""
+    failures = 0
+    early = 0
+    for index, case in enumerate(corpus):
+        text = case["input"]
+        for size in chunk_sizes:
+            streamed, first = stream_clean(text, size)
+            if streamed != clean_text_formatting(text):
+                failures += 1
+                print(f"❌ corpus case {index} streamed in {size}-char chunks: got {streamed!r}")
+            # Text should start flowing before the last chunk arrives
+            early += first is not None and first < (len(text) - 1) // size
+    total = len(corpus) * len(chunk_sizes)
+    print(f"Streaming: {total - failures}/{total} chunkings match one-shot output, "
+          f"{early}/{total} emit text before the final chunk")
+    return failures
+
+
+def check_streaming_fuzz(count, seed=4321):
+    """Random markup, streamed in random chunk sizes"""
+    alphabet = ['*', '**', '_', '__', '`', '```', '"', "'", '\\', '\\n', '\n', '\n\n', ' ', '  ',
+                '.', ':', '1', 'a', 'word', "don't", 'x y']
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(count):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        streamed, _ = stream_clean(text, rng.randint(1, 8))
+        if streamed != clean_text_formatting(text):
+            failures += 1
+            if failures <= 5:
+                print(f"❌ streaming mismatch for {text!r}")
+    print(f"Streaming fuzz: {count - failures}/{count} random inputs match one-shot output")
+    return failures
+
+
+def benchmark(corpus, repeat):
+    for label, text in [
+        ("short reply", corpus[0]["input"]),
+        ("long reply", "\n\n".join(case["input"] for case in corpus) * 20),
+    ]:
+        number = max(1, repeat * 2000 // max(len(text), 1))
+        old = min(timeit.repeat(lambda: reference_clean_text_formatting(text), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: clean_text_formatting(text), number=number, repeat=5)) / number
+        print(f"{label:12} {len(text):>8} chars  reference {old * 1e6:9.1f} µs  "
+              f"compiled {new * 1e6:9.1f} µs  speedup {old / new:5.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fuzz", type=int, default=20000, help="number of random inputs to compare")
+    parser.add_argument("--repeat", type=int, default=50, help="benchmark effort multiplier")
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    failures = check_corpus(corpus) + check_fuzz(args.fuzz)
+    failures += check_streaming(corpus) + check_streaming_fuzz(args.fuzz)
+    benchmark(corpus, args.repeat)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+Offline load and latency benchmark for /analyze, /api/chat and /api/chat/stream.
+
+Starts the Flask app in-process against a local stand-in for the IPFS gateway
+and the stub LLM backend (see llm_backends.py), drives a configurable request
+mix at a fixed concurrency and reports throughput plus p50/p95/p99 latency
+per endpoint and per analysis pipeline stage. Results are written as JSON so
+runs can be compared; pass --baseline to fail when p95 latency regresses.
+
+Usage:
+    python benchmarks/load_test.py --requests 500 --concurrency 16 \\
+        --mix analyze:3,chat:6,chat_stream:1 --llm-latency lognormal:0.2,0.5
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+
+CHAT_QUESTIONS = [
+    "How do I create a fundraiser?",
+    "How can I donate to a campaign?",
+    "When can the owner withdraw funds?",
+    "How does the remittance system work?",
+    "What happens if I lose my secret phrase?",
+    "Explain the lending pool system",
+    "How are bids placed in a ROSCA pool?",
+    "What events does the loan system emit?",
+]
+
+FOLLOW_UPS = [
+    "Can you explain that in more detail?",
+    "What are the fees involved?",
+    "Which function do I call for that?",
+]
+
+
+def make_pdf(pages):
+    """Minimal PDF with one line of Helvetica text per page line"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for index, text in enumerate(pages):
+        page_id = 4 + 2 * index
+        kids.append(f"{page_id} 0 R")
+        lines = b"".join(b"(%s) Tj 0 -14 Td " % line.encode("latin-1") for line in text.split("\n"))
+        stream = b"BT /F1 10 Tf 20 800 Td " + lines + b"ET"
+        objects.append((
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for index, body in enumerate(objects):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % (index + 1) + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def make_documents(count, pages, seed):
+    """{cid: pdf bytes} of synthetic invoices"""
+    rng = random.Random(seed)
+    documents = {}
+    for index in range(count):
+        cid = f"QmBench{index:04d}{rng.getrandbits(64):016x}"
+        documents[cid] = make_pdf([
+            f"INVOICE No {index}-{page}\nDate 2024-01-{1 + page % 28:02d}\n"
+            f"Bill to Customer {rng.randint(1, 999)}\nTotal {rng.randint(10, 9999)} USD\nAuthorized signature"
+            for page in range(pages)
+        ])
+    return documents
+
+
+def start_gateway(documents, latency):
+    """Local IPFS gateway stand-in serving documents at /ipfs/<cid> after latency seconds"""
+
+    class GatewayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = documents.get(self.path.rsplit("/", 1)[-1])
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), GatewayHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def configure_environment(args, gateway_port, work_dir):
+    """Point the app at the stand-ins; must run before server.py is imported"""
+    os.environ.update({
+        "LLM_BACKEND": "stub",
+        "LLM_STUB_LATENCY": args.llm_latency,
+        "LLM_STUB_FAILURE_RATE": str(args.llm_failure_rate),
+        "LLM_STUB_SEED": str(args.seed),
+        "LLM_REQUESTS_PER_MINUTE": str(args.llm_rpm),
+        "IPFS_GATEWAYS": f"http://127.0.0.1:{gateway_port}/ipfs/{{cid}}",
+        "PDF_CACHE_DIR": os.path.join(work_dir, "pdf_cache"),
+        "RESULT_STORE_PATH": os.path.join(work_dir, "results.db"),
+        "TEXT_CACHE_PATH": os.path.join(work_dir, "text_cache.db"),
+        "KNOWLEDGE_BASE_PATH": os.path.join(APP_DIR, "knowledge_base", "contracts.json"),
+        "KNOWLEDGE_RELOAD_INTERVAL": "0",
+        "FLASK_ENV": "production",
+    })
+    sys.path.insert(0, APP_DIR)
+
+
+def start_app():
+    """Serve the Flask app on a free local port in a background thread"""
+    from werkzeug.serving import make_server
+    import server
+
+    # One access-log line per request would swamp the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+
+def parse_mix(spec):
+    """'analyze:3,chat:6' -> [(endpoint, weight)]"""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition(":")
+        name = name.strip()
+        if name not in ("analyze", "chat", "chat_stream"):
+            raise ValueError(f"Unknown endpoint in mix: {name!r}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies):
+    """Latency summary in milliseconds"""
+    if not latencies:
+        return None
+    return {
+        "p50": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+        "max": round(max(latencies) * 1000, 2),
+    }
+
+
+class Recorder:
+    """Thread-safe collection of request outcomes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.first_event = []
+        self.stages = defaultdict(list)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.cached = defaultdict(int)
+
+    def record(self, endpoint, seconds, status, ok, cached=False, stages=None, first_event=None):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.status_codes[endpoint][str(status)] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+            if cached:
+                self.cached[endpoint] += 1
+            for name, stage_seconds in (stages or {}).items():
+                self.stages[name].append(stage_seconds)
+            if first_event is not None:
+                self.first_event.append(first_event)
+
+
+class Client:
+    """One simulated user: a keep-alive HTTP session and an optional chat session"""
+
+    def __init__(self, base_url, args, documents, rng):
+        import requests
+
+        self.http = requests.Session()
+        self.base_url = base_url
+        self.args = args
+        self.cids = list(documents)
+        self.rng = rng
+        self.session_id = None
+
+    def analyze(self, recorder):
+        body = {
+            "ipfs_hash": self.rng.choice(self.cids),
+            "force_refresh": self.rng.random() < self.args.force_refresh,
+        }
+        started = time.perf_counter()
+        response = self.http.post(f"{self.base_url}/analyze", json=body, timeout=self.args.timeout)
+        elapsed = time.perf_counter() - started
+        data = response.json()
+        recorder.record("analyze", elapsed, response.status_code, response.ok,
+                        cached=data.get("cached", False), stages=data.get("stages"))
+
+    def _chat_body(self):
+        if self.session_id and self.rng.random() < self.args.follow_ups:
+            return {"prompt": self.rng.choice(FOLLOW_UPS), "session_id": self.session_id}
+        return {"prompt": self.rng.choice(CHAT_QUESTIONS)}
+
+    def chat(self, recorder):
+        started = time.perf_counter()
+        response = self.http.post(f"{self.base_url}/api/chat", json=self._chat_body(), timeout=self.args.timeout)
+        elapsed = time.perf_counter() - started
+        data = response.json()
+        self.session_id = data.get("session_id") or self.session_id
+        recorder.record("chat", elapsed, response.status_code, response.ok, cached=data.get("cached", False))
+
+    def chat_stream(self, recorder):
+        started = time.perf_counter()
+        first_event = None
+        done = None
+        with self.http.post(f"{self.base_url}/api/chat/stream", json=self._chat_body(),
+                            timeout=self.args.timeout, stream=True) as response:
+            if response.ok:
+                event = "message"
+                for line in response.iter_lines(decode_unicode=True):
+                    if first_event is None and line:
+                        first_event = time.perf_counter() - started
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: ") and event in ("done", "error"):
+                        done = (event, json.loads(line[6:]))
+                    elif not line:
+                        event = "message"
+            status = response.status_code
+        elapsed = time.perf_counter() - started
+        ok = done is not None and done[0] == "done"
+        if ok:
+            self.session_id = done[1].get("session_id") or self.session_id
+        recorder.record("chat_stream", elapsed, status, ok,
+                        cached=ok and done[1].get("cached", False), first_event=first_event)
+
+
+def run_load(base_url, args, documents):
+    mix = parse_mix(args.mix)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    recorder = Recorder()
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + worker_id)
+        client = Client(base_url, args, documents, rng)
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            endpoint = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                getattr(client, endpoint)(recorder)
+            except Exception as e:
+                recorder.record(endpoint, time.perf_counter() - started, type(e).__name__, False)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    return recorder, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(args, recorder, duration):
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[endpoint],
+            "cached": recorder.cached[endpoint],
+            "status_codes": dict(recorder.status_codes[endpoint]),
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "latency_ms": summarize(latencies),
+        }
+    if recorder.first_event:
+        endpoints["chat_stream"]["first_event_ms"] = summarize(recorder.first_event)
+    return {
+        "benchmark": "load_test",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "duration_seconds": round(duration, 3),
+        "requests": total,
+        "throughput_rps": round(total / duration, 2),
+        "endpoints": endpoints,
+        "stages": {name: {"samples": len(values), "latency_ms": summarize(values)}
+                   for name, values in sorted(recorder.stages.items())},
+    }
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['duration_seconds']}s "
+          f"({report['throughput_rps']} req/s, concurrency {report['config']['concurrency']})\n")
+    print(f"{'endpoint':<14}{'reqs':>7}{'errors':>8}{'cached':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report["endpoints"].items():
+        latency = stats["latency_ms"]
+        print(f"{endpoint:<14}{stats['requests']:>7}{stats['errors']:>8}{stats['cached']:>8}"
+              f"{stats['throughput_rps']:>9}{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}")
+        if "first_event_ms" in stats:
+            first = stats["first_event_ms"]
+            print(f"{'  first event':<46}{first['p50']:>10}{first['p95']:>10}{first['p99']:>10}")
+    if report["stages"]:
+        print(f"\n{'stage':<14}{'samples':>7}{'':>25}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, stats in report["stages"].items():
+            latency = stats["latency_ms"]
+            print(f"{name:<14}{stats['samples']:>7}{'':>25}{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}")
+
+
+def compare(report, baseline, max_regression):
+    """Print p95 and error changes against a baseline report; returns the regressions found"""
+    regressions = []
+    print(f"\nCompared with baseline {baseline.get('git_commit')} ({baseline.get('timestamp')}):")
+    for endpoint, stats in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before or not before.get("latency_ms"):
+            continue
+        old, new = before["latency_ms"]["p95"], stats["latency_ms"]["p95"]
+        change = (new - old) / old if old else 0.0
+        print(f"  {endpoint:<14} p95 {old:>9} -> {new:>9} ms ({change:+.1%}), "
+              f"errors {before['errors']} -> {stats['errors']}")
+        if change > max_regression:
+            regressions.append(f"{endpoint} p95 latency up {change:.1%}")
+        old_rate = before["errors"] / max(before["requests"], 1)
+        new_rate = stats["errors"] / max(stats["requests"], 1)
+        if new_rate > old_rate + 0.01:
+            regressions.append(f"{endpoint} error rate {old_rate:.1%} -> {new_rate:.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="simultaneous clients")
+    parser.add_argument("--mix", default="analyze:3,chat:6,chat_stream:1", help="endpoint weights")
+    parser.add_argument("--documents", type=int, default=25, help="distinct PDFs behind the gateway")
+    parser.add_argument("--pages", type=int, default=5, help="pages per PDF")
+    parser.add_argument("--force-refresh", type=float, default=0.2,
+                        help="fraction of /analyze requests that bypass stored results")
+    parser.add_argument("--follow-ups", type=float, default=0.5,
+                        help="chance a chat request continues the client's session")
+    parser.add_argument("--gateway-latency", type=float, default=0.05, help="seconds before the gateway answers")
+    parser.add_argument("--llm-latency", default="lognormal:0.2,0.5", help="stub LLM latency spec")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="fraction of stub LLM calls that fail")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="LLM requests per minute limit (0 = unlimited)")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/load_test-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed p95 latency increase over the baseline before failing")
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents, args.pages, args.seed)
+    gateway = start_gateway(documents, args.gateway_latency)
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        configure_environment(args, gateway.server_port, work_dir)
+        httpd, base_url = start_app()
+        print(f"Benchmarking {base_url} with {args.concurrency} clients ({args.mix})...")
+        try:
+            recorder, duration = run_load(base_url, args, documents)
+        finally:
+            httpd.shutdown()
+            gateway.shutdown()
+
+    report = build_report(args, recorder, duration)
+    print_report(report)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\n❌ Regressions: " + "; ".join(regressions))
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
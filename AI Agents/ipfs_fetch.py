@@ -0,0 +1,437 @@
+"""
+Streaming, multi-gateway IPFS fetcher.
+
+The same CID is requested from several public gateways at once. Each response
+is streamed in chunks straight to a temp file under a max-bytes limit, the
+first complete PDF wins and the remaining downloads are cancelled. Per-gateway
+latency is tracked so consistently slow gateways drop to the back of the race.
+
+Gateways are URL templates containing {cid}, so the fetcher can be pointed at
+local HTTP stand-ins (e.g. http://127.0.0.1:8081/ipfs/{cid}) for testing.
+
+AsyncGatewayFetcher runs the same race on the asyncio event loop with httpx
+(an optional dependency), sharing the gateway list, limits and latency
+ranking of a GatewayFetcher.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_GATEWAYS = [
+    "https://ipfs.io/ipfs/{cid}",
+    "https://dweb.link/ipfs/{cid}",
+    "https://gateway.pinata.cloud/ipfs/{cid}",
+]
+
+PDF_MAGIC = b"%PDF-"
+
+# Weight of the newest sample in each gateway's moving-average latency
+LATENCY_ALPHA = 0.3
+
+# Gateway responses worth retrying (rate limiting and transient server errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bound on a server-supplied Retry-After, so one gateway can't stall a race
+MAX_RETRY_AFTER = 30
+
+# A cancelled loser would have taken longer than the winner by an unknown amount;
+# it is recorded as this multiple of the winner's time (capped at the timeout)
+LOSER_PENALTY = 2.0
+
+
+def gateways_from_env():
+    """Read gateway URL templates from IPFS_GATEWAYS (comma-separated)"""
+    gateways = []
+    for gateway in os.getenv("IPFS_GATEWAYS", "").split(","):
+        gateway = gateway.strip()
+        if not gateway:
+            continue
+        if "{cid}" not in gateway:
+            # Accept a bare gateway origin like https://ipfs.io
+            gateway = gateway.rstrip("/") + "/ipfs/{cid}"
+        gateways.append(gateway)
+    return gateways or list(DEFAULT_GATEWAYS)
+
+
+class GatewayRetry(Retry):
+    """urllib3 retry policy with full-jitter exponential backoff and a capped Retry-After"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+
+def create_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """Build a keep-alive session with a per-host connection pool and retry/backoff"""
+    retry = GatewayRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        backoff_factor=backoff_factor,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class FetchCancelled(Exception):
+    """Raised inside a download that lost the race"""
+
+
+def _discard_download(future):
+    """Delete the temp file of a losing download that still managed to finish"""
+    if not future.cancelled() and future.exception() is None:
+        try:
+            os.remove(future.result())
+        except OSError:
+            pass
+
+
+def _abort(response):
+    """Stop a streaming download from another thread
+
+    A read fills a whole chunk before returning and close() waits for it, so a
+    gateway dripping bytes would keep the download alive; shutting the socket
+    down makes the read return at once.
+    """
+    try:
+        # A duplicate of the descriptor shuts down the same connection
+        with socket.fromfd(response.raw.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except (OSError, ValueError, AttributeError):
+        # Already finished and closed: a fully read response has no connection left
+        pass
+
+
+class GatewayFetcher:
+    """Races a CID across several gateways and streams the winner to disk"""
+
+    def __init__(self, gateways, max_bytes, race_width=3, timeout=30, chunk_size=64 * 1024, session=None):
+        self.gateways = list(gateways)
+        self.max_bytes = max_bytes
+        self.race_width = max(1, race_width)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = session or requests
+        self._latency = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 4 * self.race_width), thread_name_prefix="ipfs-fetch")
+
+    def record_latency(self, gateway, seconds):
+        with self._lock:
+            previous = self._latency.get(gateway)
+            if previous is None:
+                self._latency[gateway] = seconds
+            else:
+                self._latency[gateway] = LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * previous
+
+    def latency_stats(self):
+        """Moving-average latency in seconds per gateway (untried gateways are omitted)"""
+        with self._lock:
+            return dict(self._latency)
+
+    def loser_latency(self, elapsed):
+        """Latency sample for a download cancelled after elapsed seconds because another won"""
+        return min(self.timeout, elapsed * LOSER_PENALTY)
+
+    def ranked_gateways(self):
+        """Fastest gateways first; untried gateways rank ahead so they get measured"""
+        stats = self.latency_stats()
+        return sorted(self.gateways, key=lambda gateway: stats.get(gateway, 0.0))
+
+    def fetch(self, ipfs_hash: str, dest_dir: str) -> str:
+        """Download ipfs_hash into a temp file in dest_dir and return its path
+
+        timeout bounds the whole fetch, not just each read, so a gateway that
+        drips bytes can't hold the request open.
+        """
+        ranked = self.ranked_gateways()
+        deadline = time.monotonic() + self.timeout
+        errors = []
+        for start in range(0, len(ranked), self.race_width):
+            if time.monotonic() >= deadline:
+                break
+            file_path = self._race(ranked[start:start + self.race_width], ipfs_hash, dest_dir, errors, deadline)
+            if file_path:
+                return file_path
+        raise Exception(f"Failed to download PDF from IPFS: {'; '.join(errors)}")
+
+    def _race(self, gateways, ipfs_hash, dest_dir, errors, deadline):
+        """Run one round of concurrent downloads; return the winner's path or None"""
+        cancel = threading.Event()
+        responses = {}
+        started = time.monotonic()
+        futures = {
+            self._executor.submit(self._download, gateway, ipfs_hash, dest_dir, cancel, responses): gateway
+            for gateway in gateways
+        }
+
+        winner_path = None
+        pending = set(futures)
+        while pending and winner_path is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                gateway = futures[future]
+                try:
+                    file_path = future.result()
+                except Exception as e:
+                    errors.append(f"{gateway.format(cid=ipfs_hash)}: {str(e)[:200]}")
+                    # Treat a failure as a full timeout so the gateway drops in the ranking
+                    self.record_latency(gateway, self.timeout)
+                    continue
+                if winner_path is None:
+                    winner_path = file_path
+                    self.record_latency(gateway, time.monotonic() - started)
+                else:
+                    # Two downloads finished together; keep only the first
+                    os.remove(file_path)
+
+        if pending:
+            # Cancel the losers: the flag stops their chunk loops and shutting the
+            # socket down ends any read still waiting on the network
+            cancel.set()
+            elapsed = time.monotonic() - started
+            for future in pending:
+                gateway = futures[future]
+                if winner_path is None:
+                    errors.append(f"{gateway.format(cid=ipfs_hash)}: no complete response within {self.timeout}s")
+                    self.record_latency(gateway, self.timeout)
+                else:
+                    self.record_latency(gateway, self.loser_latency(elapsed))
+                future.add_done_callback(_discard_download)
+                response = responses.get(gateway)
+                if response is not None:
+                    _abort(response)
+        return winner_path
+
+    def _download(self, gateway, ipfs_hash, dest_dir, cancel, responses):
+        """Stream one gateway's response to a temp file, enforcing max_bytes"""
+        url = gateway.format(cid=ipfs_hash)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                    responses[gateway] = response
+                    response.raise_for_status()
+
+                    declared = response.headers.get("Content-Length")
+                    if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                        raise Exception(f"PDF is larger than the {self.max_bytes} byte limit")
+
+                    received = 0
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if cancel.is_set():
+                            raise FetchCancelled(url)
+                        if not chunk:
+                            continue
+                        if received == 0 and not chunk.startswith(PDF_MAGIC):
+                            raise Exception("Response is not a PDF file")
+                        received += len(chunk)
+                        if received > self.max_bytes:
+                            raise Exception(f"PDF is larger than the {self.max_bytes} byte limit")
+                        f.write(chunk)
+
+                    if received == 0:
+                        raise Exception("Empty response")
+            if cancel.is_set():
+                raise FetchCancelled(url)
+            return tmp_path
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _retry_after_seconds(response):
+    """Retry-After of a response in seconds (capped at MAX_RETRY_AFTER), or None"""
+    value = response.headers.get("Retry-After", "").strip()
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (email.utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+
+class AsyncGatewayFetcher:
+    """Asyncio version of a GatewayFetcher's race on a pooled httpx.AsyncClient
+
+    Retries follow create_session(): connection errors and RETRY_STATUSES are
+    retried with full-jitter exponential backoff, honouring a capped
+    Retry-After. Losing downloads are cancelled as tasks.
+    """
+
+    def __init__(self, fetcher, pool_size=10, retries=3, backoff_factor=0.5):
+        import httpx
+
+        self.httpx = httpx
+        self.fetcher = fetcher
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self):
+        """The AsyncClient for the running event loop (clients can't be shared across loops)"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # Like requests' non-blocking pool: extra connections are opened under load, but only
+            # pool_size per gateway are kept alive
+            limits = self.httpx.Limits(max_connections=None,
+                                       max_keepalive_connections=self.pool_size * len(self.fetcher.gateways))
+            self._client = self.httpx.AsyncClient(timeout=self.fetcher.timeout, limits=limits, follow_redirects=True)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, ipfs_hash: str, dest_dir: str) -> str:
+        """Download ipfs_hash into a temp file in dest_dir and return its path"""
+        ranked = self.fetcher.ranked_gateways()
+        width = self.fetcher.race_width
+        deadline = time.monotonic() + self.fetcher.timeout
+        errors = []
+        for start in range(0, len(ranked), width):
+            if time.monotonic() >= deadline:
+                break
+            file_path = await self._race(ranked[start:start + width], ipfs_hash, dest_dir, errors, deadline)
+            if file_path:
+                return file_path
+        raise Exception(f"Failed to download PDF from IPFS: {'; '.join(errors)}")
+
+    async def _race(self, gateways, ipfs_hash, dest_dir, errors, deadline):
+        """Run one round of concurrent downloads; return the winner's path or None"""
+        client = self._get_client()
+        started = time.monotonic()
+        tasks = {
+            asyncio.ensure_future(self._download(client, gateway, ipfs_hash, dest_dir)): gateway
+            for gateway in gateways
+        }
+
+        winner_path = None
+        pending = set(tasks)
+        timed_out = False
+        try:
+            while pending and winner_path is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    gateway = tasks[task]
+                    try:
+                        file_path = task.result()
+                    except Exception as e:
+                        errors.append(f"{gateway.format(cid=ipfs_hash)}: {str(e)[:200]}")
+                        self.fetcher.record_latency(gateway, self.fetcher.timeout)
+                        continue
+                    if winner_path is None:
+                        winner_path = file_path
+                        self.fetcher.record_latency(gateway, time.monotonic() - started)
+                    else:
+                        os.remove(file_path)
+        finally:
+            if pending:
+                elapsed = time.monotonic() - started
+                for task in pending:
+                    gateway = tasks[task]
+                    if timed_out:
+                        errors.append(f"{gateway.format(cid=ipfs_hash)}: no complete response within {self.fetcher.timeout}s")
+                        self.fetcher.record_latency(gateway, self.fetcher.timeout)
+                    elif winner_path is not None:
+                        self.fetcher.record_latency(gateway, self.fetcher.loser_latency(elapsed))
+                    task.cancel()
+                # Cancelled downloads remove their own temp files; one that finished
+                # in the meantime returns its path instead
+                for outcome in await asyncio.gather(*pending, return_exceptions=True):
+                    if isinstance(outcome, str):
+                        os.remove(outcome)
+        return winner_path
+
+    def _backoff(self, attempt):
+        return random.uniform(0, self.backoff_factor * 2 ** attempt)
+
+    async def _download(self, client, gateway, ipfs_hash, dest_dir):
+        """Stream one gateway's response to a temp file, enforcing max_bytes"""
+        url = gateway.format(cid=ipfs_hash)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for attempt in range(self.retries + 1):
+                    try:
+                        async with client.stream("GET", url) as response:
+                            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                                if response.status_code >= 400:
+                                    raise Exception(f"{response.status_code} {response.reason_phrase} for url: {url}")
+                                await self._write(response, f)
+                                return tmp_path
+                            delay = _retry_after_seconds(response)
+                    except self.httpx.TransportError:
+                        if attempt == self.retries:
+                            raise
+                        delay = None
+                    await asyncio.sleep(self._backoff(attempt) if delay is None else delay)
+                    # Drop anything a failed attempt wrote before starting over
+                    f.seek(0)
+                    f.truncate()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def _write(self, response, f):
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > self.fetcher.max_bytes:
+            raise Exception(f"PDF is larger than the {self.fetcher.max_bytes} byte limit")
+
+        received = 0
+        async for chunk in response.aiter_bytes(self.fetcher.chunk_size):
+            if not chunk:
+                continue
+            if received == 0 and not chunk.startswith(PDF_MAGIC):
+                raise Exception("Response is not a PDF file")
+            received += len(chunk)
+            if received > self.fetcher.max_bytes:
+                raise Exception(f"PDF is larger than the {self.fetcher.max_bytes} byte limit")
+            # Local disk writes of one chunk are short enough to do on the loop
+            f.write(chunk)
+
+        if received == 0:
+            raise Exception("Empty response")
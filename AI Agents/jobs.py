@@ -0,0 +1,113 @@
+"""
+Background job queue for long-running analyses.
+
+Requests enqueue work and return a job id straight away; a fixed pool of
+worker threads drains the queue. The queue has a depth limit so a burst is
+pushed back to clients (QueueFull) instead of piling up in memory, and
+finished jobs are kept for a while so clients can poll for the result.
+"""
+
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its depth limit"""
+
+
+class Job:
+    def __init__(self, func, args):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "error":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded queue of jobs run by a fixed number of worker threads"""
+
+    def __init__(self, workers: int, max_pending: int, retention_seconds: float = 3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        # Started on first use so importing the server doesn't spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args) -> Job:
+        """Queue func(*args); raises QueueFull when max_pending jobs are already waiting"""
+        job = Job(func, args)
+        with self._lock:
+            self._start_workers()
+            self._prune()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"Job queue is full ({self.max_pending} pending)")
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "max_pending": self.max_pending, "jobs": counts}
+
+    def _prune(self):
+        """Forget finished jobs older than retention_seconds (caller holds the lock)"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            try:
+                job.result = job.func(*job.args)
+                job.status = "done"
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                job.error = str(e)
+                job.status = "error"
+            finally:
+                job.finished_at = time.time()
+                # Drop references to the work itself once it is finished
+                job.func = job.args = None
+                self._queue.task_done()
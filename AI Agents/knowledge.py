@@ -0,0 +1,315 @@
+"""
+Knowledge base formatting and retrieval for the Web3 chatbot.
+
+knowledge_base/contracts.json is split into per-section chunks (a contract's
+overview, key features, functions, events, ...). A BM25 inverted index is
+built over the chunks once, so each chat prompt only carries the sections
+relevant to the question instead of the whole knowledge base.
+
+KnowledgeBase watches the file and, when it changes, re-formats only the
+contracts whose entries changed, then swaps in a new snapshot (chunks, index
+and version) with a single assignment so requests never see a mix of old and
+new state.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# (JSON key, heading) for the list-style sections, in prompt order
+SECTIONS = [
+    ("key_features", "Key Features"),
+    ("functions", "Functions"),
+    ("events", "Events"),
+    ("use_cases", "Use Cases"),
+    ("workflow", "Workflow"),
+    ("participant_lifecycle", "Participant Lifecycle"),
+]
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or the this to
+what when where which who why will with you your
+""".split())
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+
+def _format_section(key, details):
+    """Render one section of a contract the way the chatbot prompt expects"""
+    if key == 'key_features':
+        return "\n".join(["Key Features:"] + [
+            f"- {feature.replace('_', ' ').title()}: {desc}" for feature, desc in details['key_features'].items()
+        ])
+    if key == 'functions':
+        return "\n".join(["Functions:"] + [f"- {func}(): {desc}" for func, desc in details['functions'].items()])
+    if key == 'events':
+        return "\n".join(["Events:"] + [f"- {event}: {desc}" for event, desc in details['events'].items()])
+    if key == 'use_cases':
+        return f"Use Cases: {', '.join(details['use_cases'])}"
+    if key == 'workflow':
+        return "\n".join(["Workflow:"] + [
+            f"- {step.replace('_', ' ').title()}: {desc}" for step, desc in details['workflow'].items()
+        ])
+    if key == 'participant_lifecycle':
+        return "\n".join(["Participant Lifecycle:"] + [
+            f"- {stage.title()}: {desc}" for stage, desc in details['participant_lifecycle'].items()
+        ])
+    raise ValueError(f"Unknown section: {key}")
+
+
+def format_contract(contract_name, details):
+    """Chunks for one contract: its overview followed by one chunk per section"""
+    chunks = [{
+        "contract": contract_name,
+        "section": "Overview",
+        "body": f"📘 {contract_name}: {details['description']}",
+    }]
+    for key, heading in SECTIONS:
+        if key in details:
+            chunks.append({
+                "contract": contract_name,
+                "section": heading,
+                "body": _format_section(key, details),
+            })
+    return chunks
+
+
+def format_sections(contracts_data):
+    """Split the knowledge base into per-section chunks"""
+    chunks = []
+    for contract_name, details in (contracts_data or {}).items():
+        chunks.extend(format_contract(contract_name, details))
+    return chunks
+
+
+def chunk_text(chunk):
+    """Standalone prompt text for a chunk, labelled with its contract"""
+    if chunk["section"] == "Overview":
+        return chunk["body"]
+    return f"📘 {chunk['contract']} - {chunk['body']}"
+
+
+def join_chunks(chunks):
+    """Full knowledge base text: each contract's sections under its overview"""
+    if not chunks:
+        return "No contract knowledge base available."
+    contracts = []
+    for chunk in chunks:
+        if chunk["section"] == "Overview":
+            contracts.append([chunk["body"]])
+        else:
+            contracts[-1].append(chunk["body"])
+    return "\n\n".join("\n\n".join(parts) for parts in contracts)
+
+
+def format_knowledge(contracts_data):
+    """Format the whole knowledge base as one prompt string"""
+    return join_chunks(format_sections(contracts_data))
+
+
+def tokenize(text):
+    """Lowercase word tokens; camelCase identifiers also yield their parts"""
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9]+", text):
+        parts = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+", word)
+        for token in {word.lower(), *(part.lower() for part in parts)}:
+            if token in STOPWORDS:
+                continue
+            # Crude plural folding so "fundraisers" matches "fundraiser"
+            if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+            tokens.append(token)
+    return tokens
+
+
+class KnowledgeIndex:
+    """In-memory BM25 inverted index over knowledge base chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.texts = [chunk_text(chunk) for chunk in self.chunks]
+        self.postings = {}
+        self.lengths = []
+        for index, chunk in enumerate(self.chunks):
+            # The contract name and heading are indexed with the body so
+            # "remittance events" finds the Remittance events section
+            terms = Counter(tokenize(f"{chunk['contract']} {chunk['section']} {chunk['body']}"))
+            self.lengths.append(sum(terms.values()))
+            for term, count in terms.items():
+                self.postings.setdefault(term, []).append((index, count))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def scores(self, query):
+        """BM25 score per chunk index for query (chunks with no matching term are omitted)"""
+        scores = {}
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, count in postings:
+                norm = count + K1 * (1 - B + B * self.lengths[index] / self.average_length)
+                scores[index] = scores.get(index, 0.0) + idf * count * (K1 + 1) / norm
+        return scores
+
+    def search(self, query, top_k, max_chars):
+        """Indexes of up to top_k relevant chunks whose combined text fits in max_chars
+
+        Questions that match nothing get the contract overviews instead.
+        """
+        scores = self.scores(query)
+        if scores:
+            ranked = sorted(scores, key=lambda index: (-scores[index], index))
+        else:
+            ranked = [index for index, chunk in enumerate(self.chunks) if chunk["section"] == "Overview"]
+
+        selected, used = [], 0
+        for index in ranked:
+            if len(selected) >= top_k:
+                break
+            size = len(self.texts[index]) + 2
+            if used + size > max_chars:
+                continue
+            selected.append(index)
+            used += size
+        return selected
+
+    def context_for(self, query, top_k, max_chars):
+        """Prompt text made of the chunks most relevant to query, in knowledge base order"""
+        selected = sorted(self.search(query, top_k, max_chars))
+        if not selected:
+            return "No relevant contract knowledge found."
+        return "\n\n".join(self.texts[index] for index in selected)
+
+
+class KnowledgeSnapshot:
+    """Immutable view of one version of the knowledge base"""
+
+    def __init__(self, version, contracts, chunks):
+        self.version = version
+        self.contracts = contracts
+        self.chunks = chunks
+        self.index = KnowledgeIndex(chunks)
+
+    def context_for(self, query, top_k, max_chars):
+        return self.index.context_for(query, top_k, max_chars)
+
+
+def _contract_digest(details):
+    """Stable digest of one contract's entry, used to skip re-formatting unchanged contracts"""
+    return hashlib.sha256(json.dumps(details, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class KnowledgeBase:
+    """contracts.json loaded into a snapshot that is replaced when the file changes
+
+    Requests read `current` once and use that snapshot throughout; reloads
+    build a complete new snapshot before publishing it. A file that fails to
+    load or parse leaves the previous snapshot in place.
+    """
+
+    def __init__(self, path, on_reload=None):
+        self.path = path
+        self.on_reload = on_reload
+        self.reloads = 0
+        self.last_error = None
+        self._signature = None
+        # contract name -> (entry digest, formatted chunks)
+        self._formatted = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self.current = KnowledgeSnapshot(hashlib.sha256(b"").hexdigest()[:16], {}, [])
+        if not self.reload() and self.last_error is None:
+            print(f"Warning: {path} not found. Chatbot functionality will be limited.")
+
+    def _file_signature(self):
+        """(mtime, size) of the file, or None if it is missing"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self, force=False):
+        """Re-read the file if it changed since the last load; returns True if a snapshot is loaded"""
+        with self._lock:
+            signature = self._file_signature()
+            if signature is None:
+                return False
+            if signature == self._signature and not force:
+                return self.reloads > 0
+            # Recorded up front so a broken file is reported once, not on every poll
+            self._signature = signature
+            try:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                version = hashlib.sha256(raw).hexdigest()[:16]
+                if version == self.current.version and not force:
+                    # Touched but not modified
+                    return True
+                contracts = json.loads(raw) or {}
+            except (OSError, ValueError) as e:
+                self.last_error = str(e)
+                print(f"Failed to reload {self.path}, keeping the previous knowledge base: {e}")
+                return self.reloads > 0
+
+            chunks, formatted, reformatted = [], {}, []
+            for contract_name, details in contracts.items():
+                digest = _contract_digest(details)
+                previous = self._formatted.get(contract_name)
+                if previous and previous[0] == digest:
+                    contract_chunks = previous[1]
+                else:
+                    contract_chunks = format_contract(contract_name, details)
+                    reformatted.append(contract_name)
+                formatted[contract_name] = (digest, contract_chunks)
+                chunks.extend(contract_chunks)
+
+            removed = [name for name in self._formatted if name not in formatted]
+            previous_version = self.current.version
+            self._formatted = formatted
+            self.current = KnowledgeSnapshot(version, contracts, chunks)
+            self.last_error = None
+            self.reloads += 1
+
+        if self.reloads > 1:
+            print(f"Knowledge base reloaded ({previous_version} -> {version}): "
+                  f"{len(reformatted)} contract(s) re-formatted, {len(removed)} removed")
+        if self.on_reload:
+            self.on_reload(self.current)
+        return True
+
+    def start_watching(self, interval):
+        """Poll the file every interval seconds in a daemon thread (interval <= 0 disables)"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="knowledge-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Knowledge base watcher error: {e}")
+
+    def stats(self):
+        snapshot = self.current
+        return {
+            "version": snapshot.version,
+            "contracts": len(snapshot.contracts),
+            "sections": len(snapshot.chunks),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
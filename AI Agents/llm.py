@@ -0,0 +1,501 @@
+"""
+Shared LLM model router used by tools.py and server.py.
+
+Every call goes through one process-wide registry that keeps per-model health:
+a rolling window of outcomes and latencies plus a circuit breaker. Models whose
+breaker is open are skipped (and only tried as a last resort) until a cooldown
+has passed, so a broken or deprecated model stops costing each request a
+failed round-trip. When the chosen model has not answered within its recent
+p95 latency, the same prompt is also sent to the next healthy model and the
+first answer wins. Calls go to the backend selected by LLM_BACKEND (see
+llm_backends.py): Gemini by default, or an offline stub for load tests.
+Nothing touches the network at import time.
+
+Every call is also admitted through the process-wide rate limiter in
+rate_limit.py; pass lane="bulk" for background work such as PDF scoring so
+interactive chat is served first. agenerate() and astream() are the same
+router for asyncio callers (asgi.py): calls and hedges are tasks on the event
+loop rather than router threads.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+import metrics
+from llm_backends import backend_from_env
+from rate_limit import INTERACTIVE, AdmissionController, RateLimited, estimate_tokens, is_rate_limit_error
+
+load_dotenv()
+
+# Model names in order of preference (override with GEMINI_MODELS=a,b,c)
+DEFAULT_MODEL_NAMES = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro", "gemini-pro"]
+
+# Circuit breaker: open after this many failures in a row, or when at least half
+# of the last HEALTH_WINDOW calls failed, and retry after the cooldown
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+BREAKER_ERROR_RATE = 0.5
+HEALTH_WINDOW = 50
+
+# Hedge a slow call once the model has this many latency samples (LLM_HEDGING=0 disables)
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "1") != "0"
+HEDGE_MIN_SAMPLES = 20
+
+# Threads running generate() calls, so a slow call can be hedged while it is in flight
+ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "32"))
+
+
+# Shared Gemini quota (LLM_REQUESTS_PER_MINUTE=0 disables the limiter)
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+
+
+LLM_REQUESTS = metrics.counter(
+    "llm_requests_total", "LLM calls by model, call type, lane and outcome", ["model", "call", "lane", "outcome"],
+)
+LLM_SECONDS = metrics.histogram(
+    "llm_request_seconds", "Latency of non-streaming LLM calls", ["model", "outcome"],
+)
+LLM_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "llm_stream_first_chunk_seconds", "Time until a streaming LLM call produced its first text", ["model"],
+)
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "LLM tokens by model: estimated before the call and reported by the backend", ["model", "source"],
+)
+LLM_HEDGES = metrics.counter(
+    "llm_hedged_requests_total", "Slow LLM calls hedged to another model, by the slow model", ["model"],
+)
+
+
+def _outcome(error):
+    if error is None:
+        return "success"
+    return "rate_limited" if is_rate_limit_error(error) else "error"
+
+
+def _model_names_from_env():
+    """Read the candidate model list from GEMINI_MODELS, falling back to the defaults"""
+    names = [name.strip() for name in os.getenv("GEMINI_MODELS", "").split(",") if name.strip()]
+    return names or list(DEFAULT_MODEL_NAMES)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelHealth:
+    """Rolling outcomes and latencies plus circuit-breaker state for one model"""
+
+    def __init__(self):
+        self.outcomes = deque(maxlen=HEALTH_WINDOW)
+        self.latencies = deque(maxlen=HEALTH_WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.hedges = 0
+
+    def state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        # After the cooldown calls are let through again; the next outcome closes or re-opens it
+        return "open" if now - self.opened_at < BREAKER_COOLDOWN else "half-open"
+
+    def record_success(self, latency):
+        self.calls += 1
+        self.outcomes.append(True)
+        if latency is not None:
+            self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self, now):
+        self.calls += 1
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= BREAKER_FAILURES or (
+            len(self.outcomes) >= BREAKER_FAILURES * 2 and self.error_rate() >= BREAKER_ERROR_RATE
+        ):
+            self.opened_at = now
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def p95(self):
+        """Recent p95 latency, or None until there are enough samples to trust it"""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return _percentile(self.latencies, 0.95)
+
+
+class ModelRegistry:
+    """Process-wide router that picks and health-checks models on one backend"""
+
+    def __init__(self, model_names, backend, limiter=None):
+        self.model_names = list(model_names)
+        self.backend = backend
+        self.limiter = limiter
+        self.active_name = None
+        self._health = {name: ModelHealth() for name in self.model_names}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def model_name(self):
+        """Name of the model requests currently go to first"""
+        return self.candidates()[0]
+
+    def candidates(self):
+        """Models with a closed or half-open breaker in order of preference, then open ones as a last resort"""
+        now = time.monotonic()
+        with self._lock:
+            states = {name: self._health[name].state(now) for name in self.model_names}
+        usable = [name for name in self.model_names if states[name] != "open"]
+        return usable + [name for name in self.model_names if states[name] == "open"]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS, thread_name_prefix="llm")
+            return self._executor
+
+    def _record(self, model_name, latency=None, error=None):
+        now = time.monotonic()
+        with self._lock:
+            health = self._health[model_name]
+            was_open = health.opened_at is not None
+            if error is None:
+                health.record_success(latency)
+            else:
+                health.record_failure(now)
+            is_open = health.opened_at is not None
+        if error is not None:
+            print(f"Model {model_name} failed: {str(error)[:100]}...")
+        if is_open != was_open:
+            print(f"Circuit breaker for {model_name} {'opened' if is_open else 'closed'}")
+
+    def _use(self, model_name):
+        if self.active_name != model_name:
+            print(f"Successfully using model: {model_name}")
+            self.active_name = model_name
+
+    def _admit(self, prompt, lane, block=True):
+        """Take rate-limiter quota for one call; returns the token estimate"""
+        tokens = estimate_tokens(prompt)
+        if self.limiter:
+            self.limiter.acquire(tokens, lane, block=block)
+        return tokens
+
+    def _failed(self, model_name, error):
+        if is_rate_limit_error(error):
+            # Running out of quota says nothing about the model, so it doesn't count
+            # towards the breaker; the limiter slows every caller down instead
+            if self.limiter:
+                self.limiter.backoff()
+            with self._lock:
+                self._health[model_name].rate_limited += 1
+            print(f"Model {model_name} is rate limited: {str(error)[:100]}...")
+            return
+        self._record(model_name, error=error)
+
+    async def _admit_async(self, prompt, lane, block=True):
+        """_admit() for asyncio callers"""
+        tokens = estimate_tokens(prompt)
+        if self.limiter:
+            await self.limiter.acquire_async(tokens, lane, block=block)
+        return tokens
+
+    def _call_failed(self, model_name, lane, started, error):
+        LLM_SECONDS.observe(time.monotonic() - started, model=model_name, outcome=_outcome(error))
+        LLM_REQUESTS.inc(model=model_name, call="generate", lane=lane, outcome=_outcome(error))
+        self._failed(model_name, error)
+
+    def _call_succeeded(self, model_name, tokens, lane, started, completion):
+        latency = time.monotonic() - started
+        LLM_SECONDS.observe(latency, model=model_name, outcome="success")
+        LLM_REQUESTS.inc(model=model_name, call="generate", lane=lane, outcome="success")
+        if completion.total_tokens:
+            LLM_TOKENS.inc(completion.total_tokens, model=model_name, source="reported")
+        self._record(model_name, latency=latency)
+        if self.limiter:
+            self.limiter.record_success()
+            if completion.total_tokens:
+                self.limiter.settle(tokens, completion.total_tokens)
+        return completion.text
+
+    def _call(self, model_name, prompt, tokens, lane, kwargs):
+        started = time.monotonic()
+        LLM_TOKENS.inc(tokens, model=model_name, source="estimated")
+        try:
+            completion = self.backend.generate(model_name, prompt, **kwargs)
+        except Exception as e:
+            self._call_failed(model_name, lane, started, e)
+            raise
+        return self._call_succeeded(model_name, tokens, lane, started, completion)
+
+    async def _acall(self, model_name, prompt, tokens, lane, kwargs):
+        started = time.monotonic()
+        LLM_TOKENS.inc(tokens, model=model_name, source="estimated")
+        try:
+            completion = await self.backend.agenerate(model_name, prompt, **kwargs)
+        except asyncio.CancelledError:
+            # A hedged call that lost the race is neither a success nor a failure of the model
+            raise
+        except Exception as e:
+            self._call_failed(model_name, lane, started, e)
+            raise
+        return self._call_succeeded(model_name, tokens, lane, started, completion)
+
+    def _hedge_delay(self, model_name):
+        if not HEDGING_ENABLED:
+            return None
+        with self._lock:
+            return self._health[model_name].p95()
+
+    def generate(self, prompt, lane=INTERACTIVE, **kwargs):
+        """Generate a response for prompt and return its text"""
+        return self.generate_with_model(prompt, lane, **kwargs)[0]
+
+    def generate_with_model(self, prompt, lane=INTERACTIVE, **kwargs):
+        """Generate a response for prompt; returns (text, name of the model that answered)
+
+        Falls through to the next candidate when a call fails, and sends one
+        hedged request to the next candidate when the first is slower than its
+        recent p95; whichever answers first is returned. Raises RateLimited if
+        the call can't get quota in time.
+        """
+        candidates = self.candidates()
+        executor = self._get_executor()
+        pending = {}
+        launched = 0
+        hedged = False
+
+        def launch(block=True):
+            nonlocal launched
+            tokens = self._admit(prompt, lane, block=block)
+            model_name = candidates[launched]
+            launched += 1
+            pending[executor.submit(self._call, model_name, prompt, tokens, lane, kwargs)] = model_name
+
+        launch()
+        while pending:
+            timeout = None
+            if not hedged and len(pending) == 1 and launched < len(candidates):
+                timeout = self._hedge_delay(next(iter(pending.values())))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                primary = next(iter(pending))
+                # A call still queued behind a saturated pool is not slow, just waiting
+                if primary.running():
+                    hedged = True
+                    try:
+                        # Hedges are optional, so they only go out when quota is free right now
+                        launch(block=False)
+                    except RateLimited:
+                        continue
+                    with self._lock:
+                        self._health[pending[primary]].hedges += 1
+                    LLM_HEDGES.inc(model=pending[primary])
+                continue
+            for future in done:
+                model_name = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception:
+                    if not pending and launched < len(candidates):
+                        launch()
+                    continue
+                self._use(model_name)
+                return text.strip(), model_name
+
+        raise Exception("No working Gemini model found. Please check your API key and try running 'python list_models.py' to see available models.")
+
+    async def agenerate(self, prompt, lane=INTERACTIVE, **kwargs):
+        """generate() for asyncio callers: same fallback, hedging and rate limiting, on the event loop"""
+        return (await self.agenerate_with_model(prompt, lane, **kwargs))[0]
+
+    async def agenerate_with_model(self, prompt, lane=INTERACTIVE, **kwargs):
+        """generate_with_model() for asyncio callers"""
+        candidates = self.candidates()
+        pending = {}
+        launched = 0
+        hedged = False
+
+        async def launch(block=True):
+            nonlocal launched
+            tokens = await self._admit_async(prompt, lane, block=block)
+            model_name = candidates[launched]
+            launched += 1
+            task = asyncio.ensure_future(self._acall(model_name, prompt, tokens, lane, kwargs))
+            pending[task] = model_name
+
+        await launch()
+        try:
+            while pending:
+                timeout = None
+                if not hedged and len(pending) == 1 and launched < len(candidates):
+                    timeout = self._hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    primary = pending[next(iter(pending))]
+                    try:
+                        await launch(block=False)
+                    except RateLimited:
+                        continue
+                    with self._lock:
+                        self._health[primary].hedges += 1
+                    LLM_HEDGES.inc(model=primary)
+                    continue
+                for task in done:
+                    model_name = pending.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception:
+                        if not pending and launched < len(candidates):
+                            await launch()
+                        continue
+                    self._use(model_name)
+                    return text.strip(), model_name
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise Exception("No working Gemini model found. Please check your API key and try running 'python list_models.py' to see available models.")
+
+    def _stream_started(self, model_name, requested):
+        """Record a stream's first chunk: the model is answering, and how long it took to start"""
+        LLM_FIRST_CHUNK_SECONDS.observe(time.monotonic() - requested, model=model_name)
+        # Time to first chunk is not comparable with generate() latency and must not
+        # lower the p95 that generate() hedges on, so only the outcome is kept
+        self._record(model_name)
+        self._use(model_name)
+        if self.limiter:
+            self.limiter.record_success()
+
+    def stream(self, prompt, lane=INTERACTIVE, **kwargs):
+        """Yield response text chunks as the model produces them
+
+        Falls back to the next candidate only while nothing has been yielded;
+        once text has reached the caller a failure is raised instead. Streams
+        are not hedged.
+        """
+        for model_name in self.candidates():
+            tokens = self._admit(prompt, lane)
+            LLM_TOKENS.inc(tokens, model=model_name, source="estimated")
+            requested = time.monotonic()
+            started = False
+            try:
+                for text in self.backend.stream(model_name, prompt, **kwargs):
+                    if not text:
+                        continue
+                    if not started:
+                        started = True
+                        self._stream_started(model_name, requested)
+                    yield text
+                if started:
+                    LLM_REQUESTS.inc(model=model_name, call="stream", lane=lane, outcome="success")
+                    return
+            except Exception as e:
+                LLM_REQUESTS.inc(model=model_name, call="stream", lane=lane, outcome=_outcome(e))
+                self._failed(model_name, e)
+                if started:
+                    raise
+
+        raise Exception("No working Gemini model found. Please check your API key and try running 'python list_models.py' to see available models.")
+
+    async def astream(self, prompt, lane=INTERACTIVE, **kwargs):
+        """stream() for asyncio callers, as an async generator"""
+        for model_name in self.candidates():
+            tokens = await self._admit_async(prompt, lane)
+            LLM_TOKENS.inc(tokens, model=model_name, source="estimated")
+            requested = time.monotonic()
+            started = False
+            try:
+                async for text in self.backend.astream(model_name, prompt, **kwargs):
+                    if not text:
+                        continue
+                    if not started:
+                        started = True
+                        self._stream_started(model_name, requested)
+                    yield text
+                if started:
+                    LLM_REQUESTS.inc(model=model_name, call="stream", lane=lane, outcome="success")
+                    return
+            except Exception as e:
+                LLM_REQUESTS.inc(model=model_name, call="stream", lane=lane, outcome=_outcome(e))
+                self._failed(model_name, e)
+                if started:
+                    raise
+
+        raise Exception("No working Gemini model found. Please check your API key and try running 'python list_models.py' to see available models.")
+
+    def stats(self):
+        """Per-model health for /health"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "state": health.state(now),
+                    "calls": health.calls,
+                    "failures": health.failures,
+                    "rate_limited": health.rate_limited,
+                    "error_rate": round(health.error_rate(), 4),
+                    "p50_seconds": round(_percentile(health.latencies, 0.5), 3) if health.latencies else None,
+                    "p95_seconds": round(_percentile(health.latencies, 0.95), 3) if health.latencies else None,
+                    "hedges": health.hedges,
+                }
+                for name, health in self._health.items()
+            }
+
+
+limiter = None
+if REQUESTS_PER_MINUTE > 0 and TOKENS_PER_MINUTE > 0:
+    limiter = AdmissionController(
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_waiting=int(os.getenv("LLM_MAX_WAITING", "100")),
+        max_wait=float(os.getenv("LLM_MAX_WAIT", "30")),
+        bulk_reserve=float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.2")),
+    )
+
+backend = backend_from_env()
+
+registry = ModelRegistry(_model_names_from_env(), backend, limiter)
+
+
+def generate(prompt, lane=INTERACTIVE, **kwargs):
+    """Generate text with the shared model registry"""
+    return registry.generate(prompt, lane=lane, **kwargs)
+
+
+def generate_with_model(prompt, lane=INTERACTIVE, **kwargs):
+    """Generate text with the shared model registry; returns (text, model name)"""
+    return registry.generate_with_model(prompt, lane=lane, **kwargs)
+
+
+async def agenerate(prompt, lane=INTERACTIVE, **kwargs):
+    """Generate text with the shared model registry from asyncio code"""
+    return await registry.agenerate(prompt, lane=lane, **kwargs)
+
+
+async def agenerate_with_model(prompt, lane=INTERACTIVE, **kwargs):
+    """Generate text with the shared model registry from asyncio code; returns (text, model name)"""
+    return await registry.agenerate_with_model(prompt, lane=lane, **kwargs)
+
+
+def stream(prompt, lane=INTERACTIVE, **kwargs):
+    """Stream text chunks with the shared model registry"""
+    return registry.stream(prompt, lane=lane, **kwargs)
+
+
+def astream(prompt, lane=INTERACTIVE, **kwargs):
+    """Stream text chunks with the shared model registry from asyncio code (an async generator)"""
+    return registry.astream(prompt, lane=lane, **kwargs)
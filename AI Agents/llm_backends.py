@@ -0,0 +1,225 @@
+"""
+LLM backends behind the model router in llm.py.
+
+A backend turns (model name, prompt) into a Completion or a stream of text
+chunks. GeminiBackend calls the Gemini API and is the default. StubBackend
+answers locally with configurable latency, injected failures and
+deterministic or canned replies, so the PDF pipeline and chatbot can be load
+tested and benchmarked with no network or API cost. Select one with
+LLM_BACKEND=gemini|stub.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+
+
+class Completion:
+    def __init__(self, text, total_tokens=None):
+        self.text = text
+        self.total_tokens = total_tokens
+
+
+class GeminiBackend:
+    """Google Gemini through google.generativeai, with one cached model object per name"""
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.api_key = api_key
+        genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return bool(self.api_key) and self.api_key != "your_gemini_api_key_here"
+
+    def get_model(self, model_name):
+        """Return the cached GenerativeModel for model_name, building it on first use"""
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = self.genai.GenerativeModel(model_name)
+                self._models[model_name] = model
+            return model
+
+    @staticmethod
+    def _completion(response):
+        usage = getattr(response, "usage_metadata", None)
+        total_tokens = getattr(usage, "total_token_count", None)
+        return Completion(response.text, total_tokens if isinstance(total_tokens, int) else None)
+
+    def generate(self, model_name, prompt, **kwargs):
+        return self._completion(self.get_model(model_name).generate_content(prompt, **kwargs))
+
+    async def agenerate(self, model_name, prompt, **kwargs):
+        """generate() on the SDK's async client, without holding a thread while waiting"""
+        return self._completion(await self.get_model(model_name).generate_content_async(prompt, **kwargs))
+
+    def stream(self, model_name, prompt, **kwargs):
+        for chunk in self.get_model(model_name).generate_content(prompt, stream=True, **kwargs):
+            yield chunk.text
+
+    async def astream(self, model_name, prompt, **kwargs):
+        """stream() on the SDK's async client"""
+        response = await self.get_model(model_name).generate_content_async(prompt, stream=True, **kwargs)
+        async for chunk in response:
+            yield chunk.text
+
+
+class StubError(Exception):
+    """Failure injected by StubBackend"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def parse_latency(spec):
+    """Sampler for a latency spec in seconds
+
+    fixed:0.2 | uniform:0.1,0.5 | normal:mean,stddev | lognormal:median,sigma
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        # Parameterised by the median so the spec reads in seconds
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+class StubBackend:
+    """Offline backend with simulated latency, injected failures and deterministic replies
+
+    Replies depend only on the prompt: JSON analyses and scores are derived
+    from its hash, other prompts get a short plain-text reply. responses maps
+    prompt substrings to canned replies that take precedence.
+    """
+
+    name = "stub"
+    configured = True
+
+    def __init__(self, latency="fixed:0", failure_rate=0.0, rate_limit_rate=0.0,
+                 failing_models=(), responses=None, stream_chunks=8, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.failing_models = set(failing_models)
+        self.responses = dict(responses or {})
+        self.stream_chunks = max(1, stream_chunks)
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        """(latency, injected error) for one call"""
+        with self._lock:
+            self.calls += 1
+            latency = self.sample_latency(self._rng)
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return latency, StubError("429 Resource has been exhausted (stub)", code=429)
+        if roll < self.rate_limit_rate + self.failure_rate:
+            return latency, StubError("503 The model is overloaded (stub)", code=503)
+        return latency, None
+
+    def reply(self, prompt, **kwargs):
+        """Deterministic reply text for prompt"""
+        for needle, canned in self.responses.items():
+            if needle in prompt:
+                return canned
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        score = int(digest[:8], 16) % 11
+        config = kwargs.get("generation_config") or {}
+        if config.get("response_mime_type") == "application/json" or "Respond with JSON" in prompt:
+            return json.dumps({"summary": f"Stub summary {digest[:8]} of a {len(prompt)} character prompt.", "score": score})
+        if "Output ONLY the score" in prompt:
+            return str(score)
+        return f"Stub reply {digest[:8]}: this is a deterministic answer to a {len(prompt)} character prompt."
+
+    def _complete(self, model_name, prompt, error, **kwargs):
+        if model_name in self.failing_models:
+            raise StubError(f"404 Model {model_name} is not found (stub)", code=404)
+        if error:
+            raise error
+        text = self.reply(prompt, **kwargs)
+        return Completion(text, total_tokens=len(prompt) // 4 + len(text) // 4)
+
+    def generate(self, model_name, prompt, **kwargs):
+        latency, error = self._draw()
+        time.sleep(latency)
+        return self._complete(model_name, prompt, error, **kwargs)
+
+    async def agenerate(self, model_name, prompt, **kwargs):
+        latency, error = self._draw()
+        await asyncio.sleep(latency)
+        return self._complete(model_name, prompt, error, **kwargs)
+
+    def _chunks(self, prompt, **kwargs):
+        """The reply to prompt split into stream_chunks pieces of whole words"""
+        words = self.reply(prompt, **kwargs).split(" ")
+        step = -(-len(words) // self.stream_chunks)
+        return [" ".join(words[i:i + step]) + (" " if i + step < len(words) else "") for i in range(0, len(words), step)]
+
+    def stream(self, model_name, prompt, **kwargs):
+        latency, error = self._draw()
+        if model_name in self.failing_models:
+            time.sleep(latency)
+            raise StubError(f"404 Model {model_name} is not found (stub)", code=404)
+        chunks = self._chunks(prompt, **kwargs)
+        for index, chunk in enumerate(chunks):
+            time.sleep(latency / len(chunks))
+            if error and index == 0:
+                raise error
+            yield chunk
+
+    async def astream(self, model_name, prompt, **kwargs):
+        latency, error = self._draw()
+        if model_name in self.failing_models:
+            await asyncio.sleep(latency)
+            raise StubError(f"404 Model {model_name} is not found (stub)", code=404)
+        chunks = self._chunks(prompt, **kwargs)
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(latency / len(chunks))
+            if error and index == 0:
+                raise error
+            yield chunk
+
+
+def backend_from_env():
+    """Backend selected by LLM_BACKEND (gemini by default)"""
+    name = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+    if name == "gemini":
+        return GeminiBackend(os.getenv("GEMINI_API_KEY"))
+    if name == "stub":
+        responses = None
+        responses_path = os.getenv("LLM_STUB_RESPONSES")
+        if responses_path:
+            with open(responses_path, "r", encoding="utf-8") as f:
+                responses = json.load(f)
+        seed = os.getenv("LLM_STUB_SEED")
+        return StubBackend(
+            latency=os.getenv("LLM_STUB_LATENCY", "fixed:0.05"),
+            failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", "0")),
+            rate_limit_rate=float(os.getenv("LLM_STUB_RATE_LIMIT_RATE", "0")),
+            failing_models=[model.strip() for model in os.getenv("LLM_STUB_FAILING_MODELS", "").split(",") if model.strip()],
+            responses=responses,
+            seed=int(seed) if seed else None,
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {name!r} (expected 'gemini' or 'stub')")
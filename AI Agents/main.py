@@ -5,25 +5,42 @@ For web interface and API, use: python server.py
 
 from agent import PdfScorerAgent
 from task import ScorePdfTask
-import os
+import llm
+import tools
+import argparse
 import json
 from dotenv import load_dotenv
 
 def main():
     """Command-line interface for PDF verification"""
     load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Analyze a PDF stored on IPFS")
+    parser.add_argument("ipfs_hash", nargs="?", help="IPFS hash of the PDF (prompted for if omitted)")
+    parser.add_argument("--force-refresh", action="store_true", help="Ignore any stored result and analyze again")
+    parser.add_argument("--rescore-all", action="store_true",
+                        help="Re-score every document with cached text using the current prompts and model")
+    args = parser.parse_args()
     
     print("🔍 PDF Verification Agent - Command Line Interface")
     print("=" * 60)
     
     # Check API key
-    if not os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") == "your_gemini_api_key_here":
+    if not llm.backend.configured:
         print("❌ Please set your GEMINI_API_KEY in a .env file")
         print("💡 For web interface, run: python server.py")
         return
     
-    # Get IPFS hash from user
-    ipfs_hash = input("📎 Enter IPFS hash of PDF file: ").strip()
+    tools.prune_results()
+
+    if args.rescore_all:
+        print("🔄 Re-scoring cached documents (no downloads or PDF parsing)...")
+        rescored, failed = tools.rescore_cached_documents(force=args.force_refresh)
+        print(f"\n✅ Re-scored {rescored} document(s), {failed} failed")
+        return
+    
+    # Get IPFS hash from the command line or the user
+    ipfs_hash = (args.ipfs_hash or input("📎 Enter IPFS hash of PDF file: ")).strip()
     
     if not ipfs_hash:
         print("❌ IPFS hash cannot be empty")
@@ -35,7 +52,7 @@ def main():
         
         # Create agent and task
         agent = PdfScorerAgent()
-        task = ScorePdfTask(ipfs_hash=ipfs_hash)
+        task = ScorePdfTask(ipfs_hash=ipfs_hash, force_refresh=args.force_refresh)
         
         # Run analysis
         result = agent.run(task)
@@ -46,6 +63,7 @@ def main():
             "ipfs_hash": ipfs_hash,
             "summary": result["summary"],
             "score": result["score"],
+            "cached": result["cached"],
             "message": f"PDF analysis completed. Genuineness score: {result['score']}/10"
         }
         
@@ -0,0 +1,242 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are registered once at import time by the
+modules that update them (pipeline.py, llm.py, server.py) and rendered by the
+/metrics endpoint. Updating a metric takes a lock, a dict lookup and, for
+histograms, a bisect, so instrumentation can stay on in production.
+Histograms also keep their recent samples so /health can report rolling
+p50/p95/p99 latencies without a Prometheus server.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+
+# Seconds; covers fast cache hits through slow multi-page LLM analyses
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Rolling summaries in /health cover this many seconds (and at most ROLLING_SAMPLES samples per series)
+ROLLING_WINDOW = 300
+ROLLING_SAMPLES = 2048
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback when metrics are rendered
+
+    callback returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Metric {self.name} callback failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class _Series:
+    def __init__(self, bucket_count):
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=ROLLING_SAMPLES)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.bounds, value)
+        now = time.monotonic()
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.bounds) + 1)
+            series.buckets[index] += 1
+            series.count += 1
+            series.sum += value
+            series.recent.append((now, value))
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            snapshot = sorted((key, list(series.buckets), series.count, series.sum)
+                              for key, series in self._series.items())
+        lines = []
+        for key, buckets, count, total in snapshot:
+            cumulative = 0
+            for bound, bucket in zip(self.bounds + (float("inf"),), buckets):
+                cumulative += bucket
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+        return lines
+
+    def rolling_summary(self, window=ROLLING_WINDOW):
+        """{"label=value,...": {count, p50, p95, p99}} over the last window seconds, in milliseconds"""
+        cutoff = time.monotonic() - window
+        with self._lock:
+            recent = {key: [value for at, value in series.recent if at >= cutoff]
+                      for key, series in self._series.items()}
+        summary = {}
+        for key, values in sorted(recent.items()):
+            if not values:
+                continue
+            values.sort()
+            name = ",".join(f"{label}={value}" for label, value in zip(self.labelnames, key)) or "all"
+            summary[name] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+            }
+        return summary
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def rolling_summary(self, window=ROLLING_WINDOW):
+        """Recent latency percentiles of every histogram with samples in the window"""
+        with self._lock:
+            histograms = [metric for metric in self._metrics.values() if isinstance(metric, Histogram)]
+        summary = {}
+        for histogram in histograms:
+            series = histogram.rolling_summary(window)
+            if series:
+                summary[histogram.name] = series
+        return summary
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name, documentation, callback, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, callback, labelnames))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    return REGISTRY.render()
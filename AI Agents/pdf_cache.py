@@ -0,0 +1,153 @@
+"""
+Content-addressed on-disk cache for PDFs downloaded from IPFS.
+
+An IPFS CID is immutable, so a document only ever needs to be fetched once.
+Each entry is stored as {cid}.pdf next to a {cid}.sha256 sidecar that is
+checked on every read. Writes go through a temp file and an atomic rename,
+and the least recently used entries are evicted once the cache grows past
+its size cap.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+# CIDv0 (Qm...) and CIDv1 (base32/base58) only use alphanumeric characters
+CID_PATTERN = re.compile(r"^[A-Za-z0-9]{1,128}$")
+
+PDF_MAGIC = b"%PDF-"
+
+# Temp files older than this are assumed to be abandoned
+STALE_TMP_SECONDS = 3600
+
+
+def validate_cid(ipfs_hash: str) -> str:
+    """Reject anything that is not a plain CID so it is safe to use as a file name"""
+    if not CID_PATTERN.match(ipfs_hash or ""):
+        raise Exception(f"Invalid IPFS hash: {ipfs_hash!r}")
+    return ipfs_hash
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfCache:
+    """Size-capped LRU cache of PDFs keyed by IPFS CID"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, ipfs_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{validate_cid(ipfs_hash)}.pdf")
+
+    def _digest_path(self, ipfs_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{validate_cid(ipfs_hash)}.sha256")
+
+    def digest(self, ipfs_hash: str):
+        """Stored SHA-256 of a cached PDF, or None if there is no entry"""
+        try:
+            with open(self._digest_path(ipfs_hash), 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def get(self, ipfs_hash: str):
+        """Return the path of a verified cached PDF, or None on a miss"""
+        file_path = self.path_for(ipfs_hash)
+        expected = self.digest(ipfs_hash)
+        if expected is None or not os.path.exists(file_path):
+            return None
+
+        try:
+            with open(file_path, 'rb') as f:
+                header = f.read(len(PDF_MAGIC))
+            valid = header == PDF_MAGIC and file_sha256(file_path) == expected
+        except OSError:
+            valid = False
+
+        if not valid:
+            print(f"Discarding corrupt cache entry for {ipfs_hash}")
+            self.remove(ipfs_hash)
+            return None
+
+        # Bump the modification time so eviction treats this entry as recently used
+        os.utime(file_path, None)
+        return file_path
+
+    def put(self, ipfs_hash: str, content: bytes) -> str:
+        """Atomically store content for ipfs_hash and return the cached path"""
+        validate_cid(ipfs_hash)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        return self.commit(ipfs_hash, tmp_path)
+
+    def commit(self, ipfs_hash: str, tmp_path: str) -> str:
+        """Move a fully written temp file into the cache under ipfs_hash"""
+        try:
+            file_path = self.path_for(ipfs_hash)
+            with open(tmp_path, 'rb') as f:
+                if f.read(len(PDF_MAGIC)) != PDF_MAGIC:
+                    raise Exception(f"Content for {ipfs_hash} is not a PDF file")
+
+            digest_fd, digest_tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(digest_fd, 'w') as f:
+                f.write(file_sha256(tmp_path))
+            os.replace(digest_tmp, self._digest_path(ipfs_hash))
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict()
+        return file_path
+
+    def remove(self, ipfs_hash: str):
+        for path in (self.path_for(ipfs_hash), self._digest_path(ipfs_hash)):
+            self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            now = time.time()
+            for name in os.listdir(self.cache_dir):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                if name.endswith(".tmp") and now - stat.st_mtime > STALE_TMP_SECONDS:
+                    # Left behind by a writer that crashed mid-download
+                    self._unlink(os.path.join(self.cache_dir, name))
+                if not name.endswith(".pdf"):
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".pdf")]))
+                total += stat.st_size
+
+            # Oldest first; always keep the most recently used entry
+            entries.sort()
+            for _, size, ipfs_hash in entries[:-1]:
+                if total <= self.max_bytes:
+                    break
+                self.remove(ipfs_hash)
+                total -= size
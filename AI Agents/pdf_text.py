@@ -0,0 +1,98 @@
+"""
+PDF text extraction.
+
+Pages are parsed lazily, so callers that only need the first few thousand
+characters stop reading once their budget is met. When the full text is
+needed, page ranges can be parsed in parallel in a process pool. Both paths
+respect a page-count limit so an oversized or hostile PDF can't keep a core
+busy indefinitely.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+from PyPDF2 import PdfReader
+
+# Bump the suffix when extraction output changes so cached text is re-parsed
+PARSER_VERSION = f"PyPDF2-{PyPDF2.__version__}/1"
+
+# Never parse more than this many pages of a single document
+MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "300"))
+
+# Processes used to parse the full text of large documents (1 disables the pool)
+PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "1"))
+
+# Documents with fewer pages than this are always parsed in-process
+PARALLEL_MIN_PAGES = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn keeps worker processes clear of the server's threads and locks
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _page_limit(reader, max_pages, file_path):
+    page_count = len(reader.pages)
+    if page_count > max_pages:
+        print(f"{file_path} has {page_count} pages; only the first {max_pages} are parsed")
+        return max_pages
+    return page_count
+
+
+def iter_page_text(file_path: str, max_pages: int = None):
+    """Yield the text of each page in order, parsing a page only when it is requested"""
+    reader = PdfReader(file_path)
+    for index in range(_page_limit(reader, max_pages or MAX_PAGES, file_path)):
+        yield reader.pages[index].extract_text() or ""
+
+
+def _extract_range(file_path, start, stop):
+    """Worker-process entry point: text of pages [start, stop)"""
+    reader = PdfReader(file_path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def extract_pages(file_path: str, max_chars: int = None, max_pages: int = None):
+    """Return (page texts, complete), stopping once max_chars characters have been read
+
+    complete is False when pages were left unparsed because the budget was met.
+    """
+    max_pages = max_pages or MAX_PAGES
+
+    if max_chars is None and PARSE_WORKERS > 1:
+        page_count = _page_limit(PdfReader(file_path), max_pages, file_path)
+        if page_count >= PARALLEL_MIN_PAGES:
+            step = -(-page_count // PARSE_WORKERS)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            pool = _get_pool()
+            futures = [pool.submit(_extract_range, file_path, start, stop) for start, stop in ranges]
+            return [page for future in futures for page in future.result()], True
+
+    pages = []
+    total = 0
+    for page in iter_page_text(file_path, max_pages):
+        pages.append(page)
+        # +1 for the separator between pages
+        total += len(page) + 1
+        if max_chars is not None and total >= max_chars:
+            return pages, False
+    return pages, True
+
+
+def extract_text(file_path: str, max_chars: int = None, max_pages: int = None) -> str:
+    """Text of the document (pages joined by spaces), at most max_chars long if given"""
+    pages, _ = extract_pages(file_path, max_chars, max_pages)
+    text = " ".join(pages)
+    return text if max_chars is None else text[:max_chars]
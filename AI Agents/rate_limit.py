@@ -0,0 +1,247 @@
+"""
+Process-wide admission control for LLM calls.
+
+PDF analysis and the chatbot share one Gemini quota, so every call is admitted
+through token buckets over requests and estimated tokens per minute. Callers
+that can't be admitted yet wait in a bounded queue; interactive calls are
+always admitted ahead of bulk ones, and bulk calls may not draw the buckets
+below a reserve kept for interactive traffic. A 429 from the API pauses all
+admissions with exponential backoff instead of letting every waiting caller
+hit the quota again.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# Token estimate for a call: prompt characters / 4 plus this many output tokens
+OUTPUT_TOKEN_ESTIMATE = 512
+
+# Buckets hold this many seconds' worth of quota, so a burst can't spend a whole minute at once
+BURST_SECONDS = 10
+
+# Backoff after a 429 when the API gives no retry delay: 1s, 2s, 4s, ... up to MAX_BACKOFF
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# How often asyncio callers waiting their turn re-check the queue
+ASYNC_POLL_SECONDS = 0.05
+
+
+class RateLimited(Exception):
+    """Raised when a call can't be admitted within the wait limit or the wait queue is full"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt):
+    return len(str(prompt)) // 4 + OUTPUT_TOKEN_ESTIMATE
+
+
+def is_rate_limit_error(error):
+    """True for quota errors from the API (HTTP 429 / RESOURCE_EXHAUSTED)"""
+    if getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted":
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class TokenBucket:
+    """Bucket refilled at per_minute / 60 units per second, holding BURST_SECONDS of quota"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, floor=0.0):
+        """Seconds until amount can be taken without dropping below floor"""
+        # A single call larger than the bucket is admitted once the bucket is full
+        amount = min(amount, self.capacity - floor)
+        missing = amount + floor - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        # Level may go negative when a call used more tokens than estimated
+        self.level -= amount
+
+
+class AdmissionController:
+    """Token-bucket limiter over requests and tokens with interactive and bulk lanes"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_waiting: int, max_wait: float, bulk_reserve: float = 0.2):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.bulk_reserve = bulk_reserve
+        self.paused_until = 0.0
+        self.admitted = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self.throttled = 0
+        self._strikes = 0
+        self._waiting = {lane: deque() for lane in LANES}
+        self._cond = threading.Condition()
+
+    def _delay(self, lane, tokens, now):
+        """Seconds until a call in lane can be admitted, or None if it must wait its turn"""
+        if self.paused_until > now:
+            return self.paused_until - now
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if lane == BULK:
+            if self._waiting[INTERACTIVE]:
+                return None
+            return max(
+                self.requests.wait_time(1, self.requests.capacity * self.bulk_reserve),
+                self.tokens.wait_time(tokens, self.tokens.capacity * self.bulk_reserve),
+            )
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _admit(self, lane, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted[lane] += 1
+
+    def _try_now(self, lane, tokens, now):
+        """Admit a call that doesn't queue, or raise RateLimited (caller holds the lock)"""
+        delay = None if self._waiting[lane] else self._delay(lane, tokens, now)
+        if delay != 0:
+            raise RateLimited("LLM quota is busy", delay or 1.0)
+        self._admit(lane, tokens)
+
+    def _enqueue(self, lane, now):
+        """Join the lane's wait queue and return the ticket (caller holds the lock)"""
+        if sum(len(waiting) for waiting in self._waiting.values()) >= self.max_waiting:
+            self.rejected[lane] += 1
+            raise RateLimited("Too many LLM calls waiting for quota", self._retry_after(now))
+        ticket = object()
+        self._waiting[lane].append(ticket)
+        return ticket
+
+    def _poll(self, ticket, lane, tokens, now, deadline):
+        """Admit the ticket if it's its turn and quota is free; else the seconds to wait (None = until notified)"""
+        queue = self._waiting[lane]
+        delay = None if queue[0] is not ticket else self._delay(lane, tokens, now)
+        if delay == 0:
+            self._admit(lane, tokens)
+            return 0
+        if now >= deadline:
+            self.rejected[lane] += 1
+            raise RateLimited("Timed out waiting for LLM quota", self._retry_after(now))
+        return delay
+
+    def _leave(self, ticket, lane):
+        self._waiting[lane].remove(ticket)
+        self._cond.notify_all()
+
+    def acquire(self, tokens: int, lane: str = INTERACTIVE, block: bool = True):
+        """Take quota for one call of about tokens tokens, waiting up to max_wait seconds
+
+        With block=False the call is admitted only if quota is free right now
+        and nobody is waiting ahead of it (used for optional hedged requests).
+        """
+        if lane not in self._waiting:
+            raise ValueError(f"Unknown lane: {lane}")
+        with self._cond:
+            now = time.monotonic()
+            if not block:
+                self._try_now(lane, tokens, now)
+                return
+
+            ticket = self._enqueue(lane, now)
+            deadline = now + self.max_wait
+            try:
+                while True:
+                    delay = self._poll(ticket, lane, tokens, now, deadline)
+                    if delay == 0:
+                        return
+                    remaining = deadline - now
+                    self._cond.wait(remaining if delay is None else min(delay, remaining))
+                    now = time.monotonic()
+            finally:
+                self._leave(ticket, lane)
+
+    async def acquire_async(self, tokens: int, lane: str = INTERACTIVE, block: bool = True):
+        """acquire() for asyncio callers: waits in the same queues without blocking the event loop"""
+        if lane not in self._waiting:
+            raise ValueError(f"Unknown lane: {lane}")
+        with self._cond:
+            now = time.monotonic()
+            if not block:
+                self._try_now(lane, tokens, now)
+                return
+            ticket = self._enqueue(lane, now)
+        deadline = now + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    delay = self._poll(ticket, lane, tokens, now, deadline)
+                if delay == 0:
+                    return
+                # Async waiters can't wait on the condition, so they re-check periodically
+                await asyncio.sleep(min(ASYNC_POLL_SECONDS if delay is None else delay, deadline - now))
+        finally:
+            with self._cond:
+                self._leave(ticket, lane)
+
+    def _retry_after(self, now):
+        return max(1.0, self.paused_until - now, self.requests.wait_time(1))
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token bucket once a call reports the tokens it really used"""
+        with self._cond:
+            self.tokens.take(actual - estimated)
+
+    def backoff(self, retry_after: float = None):
+        """Pause all admissions after the API answered 429"""
+        with self._cond:
+            self._strikes += 1
+            self.throttled += 1
+            if retry_after is None:
+                retry_after = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (self._strikes - 1))
+                retry_after *= random.uniform(0.5, 1.0)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            print(f"LLM quota exceeded; pausing calls for {retry_after:.1f}s")
+
+    def record_success(self):
+        if self._strikes:
+            with self._cond:
+                self._strikes = 0
+
+    def bulk_burst(self):
+        """Bulk calls that full buckets admit back to back, without waiting for quota"""
+        return int(self.requests.capacity * (1 - self.bulk_reserve))
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "requests_available": round(self.requests.level, 2),
+                "requests_capacity": round(self.requests.capacity, 2),
+                "tokens_available": round(self.tokens.level),
+                "tokens_capacity": round(self.tokens.capacity),
+                "waiting": {lane: len(waiting) for lane, waiting in self._waiting.items()},
+                "max_waiting": self.max_waiting,
+                "paused_seconds": round(max(0.0, self.paused_until - now), 2),
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+                "throttled": self.throttled,
+            }
@@ -0,0 +1,82 @@
+"""
+Persistent store of PDF analysis results.
+
+A result only depends on the (immutable) document, the model and the prompt
+templates, so entries are keyed by (CID, model name, prompt version). Changing
+a prompt in tools.py changes the prompt version, which makes every older entry
+unreachable; prune() then deletes them.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ResultStore:
+    """SQLite-backed memo of ScorePdfTask results"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    ipfs_hash TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (ipfs_hash, model_name, prompt_version)
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, ipfs_hash: str, model_name: str, prompt_version: str):
+        """Return the stored result dict, or None on a miss"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result FROM results WHERE ipfs_hash = ? AND model_name = ? AND prompt_version = ?",
+                (ipfs_hash, model_name, prompt_version),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_first(self, ipfs_hash: str, model_names: list, prompt_version: str):
+        """Return the stored result of the first of model_names that has one, or None"""
+        with self._connect() as conn:
+            rows = dict(conn.execute(
+                "SELECT model_name, result FROM results WHERE ipfs_hash = ? AND prompt_version = ?",
+                (ipfs_hash, prompt_version),
+            ).fetchall())
+        for model_name in model_names:
+            if model_name in rows:
+                return json.loads(rows[model_name])
+        return None
+
+    def put(self, ipfs_hash: str, model_name: str, prompt_version: str, result: dict):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (ipfs_hash, model_name, prompt_version, json.dumps(result), time.time()),
+            )
+
+    def prune(self, prompt_versions: list) -> int:
+        """Delete results produced with any prompt version not in prompt_versions; returns the number removed"""
+        placeholders = ", ".join("?" * len(prompt_versions))
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                f"DELETE FROM results WHERE prompt_version NOT IN ({placeholders})", list(prompt_versions),
+            ).rowcount
@@ -1,12 +1,24 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, render_template_string
 from flask_cors import CORS
 from agent import PdfScorerAgent
 from task import ScorePdfTask
+from jobs import JobQueue, QueueFull
+from knowledge import KnowledgeBase
+from ttl_cache import TTLCache
+from text_format import StreamingCleaner, clean_text_formatting
+from sessions import SessionStore, format_turns
+from singleflight import SingleFlight
+from pdf_cache import validate_cid
 import os
 import json
-import google.generativeai as genai
+import llm
+import metrics
+import tools
 from dotenv import load_dotenv
 import traceback
+import time
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Load environment variables
 load_dotenv()
@@ -14,112 +26,186 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize Gemini for both PDF analysis and chatbot
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
-
-# Load and format the knowledge base for chatbot
-try:
-    with open('knowledge_base/contracts.json', 'r') as f:
-        contracts = json.load(f)
-except FileNotFoundError:
-    print("Warning: knowledge_base/contracts.json not found. Chatbot functionality will be limited.")
-    contracts = {}
-
-# Helper to format contracts into a structured prompt
-def format_knowledge(contracts_data):
-    if not contracts_data:
-        return "No contract knowledge base available."
-    
-    formatted = []
-    for contract_name, details in contracts_data.items():
-        section = [f"📘 {contract_name}: {details['description']}"]
-
-        if 'key_features' in details:
-            section.append("\nKey Features:")
-            for feature, desc in details['key_features'].items():
-                section.append(f"- {feature.replace('_', ' ').title()}: {desc}")
-
-        if 'functions' in details:
-            section.append("\nFunctions:")
-            for func, desc in details['functions'].items():
-                section.append(f"- {func}(): {desc}")
-
-        if 'events' in details:
-            section.append("\nEvents:")
-            for event, desc in details['events'].items():
-                section.append(f"- {event}: {desc}")
-
-        if 'use_cases' in details:
-            use_cases = ", ".join(details['use_cases'])
-            section.append(f"\nUse Cases: {use_cases}")
-
-        if 'workflow' in details:
-            section.append("\nWorkflow:")
-            for step, desc in details['workflow'].items():
-                section.append(f"- {step.replace('_', ' ').title()}: {desc}")
-
-        if 'participant_lifecycle' in details:
-            section.append("\nParticipant Lifecycle:")
-            for stage, desc in details['participant_lifecycle'].items():
-                section.append(f"- {stage.title()}: {desc}")
-
-        formatted.append("\n".join(section))
-    return "\n\n".join(formatted)
-
-# Pre-generate context once at startup
-formatted_context = format_knowledge(contracts)
-
-def clean_text_formatting(text):
-    """Remove all markdown and special formatting from text"""
-    import re
-    
-    # First, handle all possible escape sequences
-    text = text.replace('\\n\\n', '\n\n')  # Double escaped newlines
-    text = text.replace('\\n', '\n')       # Single escaped newlines
-    text = text.replace('\\t', ' ')        # Escaped tabs
-    text = text.replace('\\r', '')         # Escaped carriage returns
-    
-    # Remove markdown bold (**text** and __text__)
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'__(.*?)__', r'\1', text)
-    
-    # Remove markdown italic (*text* and _text_)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-    text = re.sub(r'_(.*?)_', r'\1', text)
-    
-    # Remove code blocks (```text```)
-    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
-    
-    # Remove inline code (`text`)
-    text = re.sub(r'`(.*?)`', r'\1', text)
-    
-    # Remove extra quotes
-    text = re.sub(r'"([^"]*)"', r'\1', text)
-    text = re.sub(r"'([^']*)'", r'\1', text)
-    
-    # Remove escaped formatting characters
-    text = re.sub(r'\\([*_`"\'])', r'\1', text)
-    
-    # Handle numbered lists more aggressively - catch all variations
-    # \n\n1. -> \n\n1. (keep as is)
-    # \n\n1 -> \n\n1. 
-    # \n\n1: -> \n\n1. 
-    text = re.sub(r'\n\n(\d+)[:\s]*', r'\n\n\1. ', text)
-    
-    # Clean up multiple consecutive newlines
-    text = re.sub(r'\n{3,}', '\n\n', text)          # 3+ newlines to 2
-    text = re.sub(r'\n\s+\n', '\n\n', text)         # Newlines with spaces between
-    text = re.sub(r'[ \t]{2,}', ' ', text)          # Multiple spaces/tabs to single
-    
-    # Clean up formatting artifacts around punctuation
-    text = re.sub(r'\s+([.,:;!?])', r'\1', text)    # Remove spaces before punctuation
-    text = re.sub(r'([.,:;!?])\s{2,}', r'\1 ', text) # Multiple spaces after punctuation to single
-    
-    # Final cleanup
-    text = text.strip()
-    
-    return text
+# The LLM backend is configured once in llm.py and shared by PDF analysis and chatbot
+
+# Batch analysis limits
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+# Background analyses submitted through /jobs
+job_queue = JobQueue(
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("JOB_QUEUE_DEPTH", "100")),
+    retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", "3600")),
+)
+
+# Concurrent analyses of one document, keyed by (CID, force_refresh)
+analysis_flight = SingleFlight()
+
+# Chat prompts carry at most this many of the most relevant sections
+CHAT_CONTEXT_TOP_K = int(os.getenv("CHAT_CONTEXT_TOP_K", "4"))
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "6000"))
+
+# Answers to repeated questions, keyed by (knowledge base version, normalized question)
+answer_cache = TTLCache(
+    max_entries=int(os.getenv("CHAT_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL", "3600")),
+)
+
+# Load and index the knowledge base for chatbot. The file is polled for changes and
+# a new snapshot is swapped in without a restart; answers cached for the old
+# version can no longer be reached, so they are dropped.
+knowledge_base = KnowledgeBase(
+    os.getenv("KNOWLEDGE_BASE_PATH", "knowledge_base/contracts.json"),
+    on_reload=lambda snapshot: answer_cache.clear(),
+)
+knowledge_base.start_watching(float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "5")))
+
+# Prompt used to fold older chat turns into a session's running summary
+CHAT_SUMMARY_PROMPT = """
+Update the running summary of a conversation between a user and a Web3 platform assistant.
+Keep the facts, contract names, functions and user goals needed to answer follow-up questions.
+Reply with plain text only, at most {max_chars} characters.
+
+Current summary:
+{summary}
+
+New turns to add:
+{turns}
+"""
+
+def summarize_chat_history(summary, turns, max_chars):
+    """Fold rolled-off chat turns into the running summary with the LLM"""
+    return clean_text_formatting(llm.generate(CHAT_SUMMARY_PROMPT.format(
+        max_chars=max_chars, summary=summary or "(none)", turns=format_turns(turns),
+    ), lane="bulk"))
+
+# Server-side chat sessions: recent turns verbatim, older turns rolled into a
+# running summary so the history in each prompt stays under CHAT_HISTORY_MAX_CHARS
+chat_sessions = SessionStore(
+    max_bytes=int(float(os.getenv("CHAT_SESSIONS_MAX_MB", "64")) * 1024 * 1024),
+    ttl=float(os.getenv("CHAT_SESSION_TTL", "1800")),
+    history_chars=int(os.getenv("CHAT_HISTORY_MAX_CHARS", "3000")),
+    summary_chars=int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1000")),
+    summarize=summarize_chat_history,
+)
+
+# Request metrics, exposed at /metrics; streamed chat replies are timed to the end of the stream
+HTTP_SECONDS = metrics.histogram(
+    "http_request_seconds", "Time to produce each HTTP response", ["endpoint", "method", "status"],
+)
+CHAT_REQUESTS = metrics.counter(
+    "chat_requests_total", "Chat requests by endpoint and outcome", ["endpoint", "outcome"],
+)
+CHAT_SECONDS = metrics.histogram(
+    "chat_request_seconds", "Time to answer a chat request, including the whole stream", ["endpoint", "outcome"],
+)
+ANALYSES = metrics.counter(
+    "pdf_analyses_total", "PDF analyses by outcome (stored result, analyzed, coalesced or error)", ["outcome"],
+)
+metrics.gauge("jobs", "Background analysis jobs by status",
+              lambda: {(status,): count for status, count in job_queue.stats()["jobs"].items()}, ["status"])
+metrics.gauge("chat_sessions", "Live chat sessions", lambda: chat_sessions.stats()["sessions"])
+metrics.gauge("chat_answer_cache_entries", "Cached chat answers", lambda: len(answer_cache))
+metrics.gauge("llm_admission_waiting", "LLM calls waiting for rate-limiter quota, by lane",
+              lambda: {(lane,): count for lane, count in llm.limiter.stats()["waiting"].items()} if llm.limiter else {},
+              ["lane"])
+
+def observe_chat(endpoint, outcome, started):
+    CHAT_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    CHAT_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, outcome=outcome)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                             method=request.method, status=response.status_code)
+    return response
+
+def parse_flag(value):
+    """A JSON boolean option: true/false, or the strings "true"/"false" (also 1/0, yes/no); None if invalid
+
+    bool() would read the string "false" as true.
+    """
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes"):
+        return True
+    if text in ("false", "0", "no", ""):
+        return False
+    return None
+
+def ipfs_hash_error(value):
+    """Why value can't be analyzed as an IPFS hash, or None if it can"""
+    if not isinstance(value, str):
+        return "'ipfs_hash' must be a string"
+    if not value.strip():
+        return "IPFS hash cannot be empty"
+    try:
+        validate_cid(value.strip())
+    except Exception as e:
+        return str(e)
+    return None
+
+def invalid_flag_response(name):
+    return jsonify({
+        "error": f"'{name}' must be true or false",
+        "status": "error"
+    }), 400
+
+def normalize_question(prompt):
+    """Collapse case, whitespace and trailing punctuation so rephrasings of the same question match"""
+    return re.sub(r'\s+', ' ', prompt.lower()).strip(' ?!.')
+
+# Prompt for the Web3 chatbot; {context} is filled with the relevant knowledge base sections
+CHAT_PROMPT_TEMPLATE = """
+You are a helpful AI assistant for a decentralized Web3 application.
+
+The platform includes smart contracts for:
+- Fundraising (FundraiserDApp)
+- Remittance (secure peer-to-peer transfers)
+- Lending pools using a ROSCA model (MultiPoolLoanSystem)
+
+Below are the sections of the system contracts knowledge base most relevant to the question:
+
+{context}
+
+IMPORTANT FORMATTING RULES:
+- Use ONLY plain text in your response
+- Do NOT use any markdown formatting like **bold**, *italic*, or `code`
+- Do NOT use asterisks (*), quotes ("), backticks (`), or other special characters for formatting
+- Do NOT use numbered lists with special formatting
+- Use simple numbered lists like: 1. First item, 2. Second item
+- Use simple bullet points with dashes: - Item one, - Item two
+- Keep responses clean and readable without any markup
+
+Now, answer the following user query with accurate, simple, and clear instructions in plain text only.
+Be helpful and provide specific details from the knowledge base when relevant.
+If the user asks about functions, explain how to use them.
+If they ask about workflows, walk them through the steps.
+Keep your responses concise but informative.
+
+{history}User: {prompt}
+"""
+
+def build_chat_prompt(prompt, knowledge, session=None):
+    """Create full prompt with the knowledge base sections relevant to this question and the session history"""
+    history = ""
+    query = prompt
+    if session is not None and session.has_history:
+        history = f"Conversation so far:\n{session.history(chat_sessions.history_chars)}\n\n"
+        # Follow-ups like "what events does it emit?" rely on the previous question for retrieval
+        query = f"{session.last_question()} {prompt}"
+    relevant_context = knowledge.context_for(query, CHAT_CONTEXT_TOP_K, CHAT_CONTEXT_MAX_CHARS)
+    return CHAT_PROMPT_TEMPLATE.format(context=relevant_context, history=history, prompt=prompt)
 
 # HTML template for the web interface with both services
 HTML_TEMPLATE = """
@@ -213,8 +299,6 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
-        let chatHistory = [];
-
         function switchTab(tabName) {
             // Hide all tabs
             document.querySelectorAll('.tab-content').forEach(tab => {
@@ -278,7 +362,9 @@ HTML_TEMPLATE = """
             }
         });
 
-        // Chatbot functionality
+        // Chatbot functionality; the server keeps the conversation for this session
+        let chatSessionId = null;
+
         async function sendChatMessage() {
             const prompt = document.getElementById('chatPrompt').value.trim();
             if (!prompt) return;
@@ -289,36 +375,61 @@ HTML_TEMPLATE = """
             addChatMessage('user', prompt);
             document.getElementById('chatPrompt').value = '';
             
-            // Show loading
-            addChatMessage('bot', '🤔 Thinking...');
+            // Show loading until the first tokens arrive
+            const botDiv = addChatMessage('bot', '🤔 Thinking...');
+            let reply = '';
             
             try {
-                const response = await fetch('/api/chat', {
+                const response = await fetch('/api/chat/stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({prompt: prompt})
+                    body: JSON.stringify({prompt: prompt, session_id: chatSessionId})
                 });
                 
-                const data = await response.json();
-                
-                // Remove loading message
-                const messages = chatHistoryDiv.querySelectorAll('.chat-message');
-                if (messages.length > 0) {
-                    messages[messages.length - 1].remove();
+                if (!response.ok) {
+                    const data = await response.json();
+                    botDiv.textContent = `❌ Error: ${data.error}`;
+                    return;
                 }
                 
-                if (response.ok) {
-                    addChatMessage('bot', data.reply);
-                } else {
-                    addChatMessage('bot', `❌ Error: ${data.error}`);
+                // Read server-sent events as they arrive and render each delta
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                        const frame = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        
+                        let eventName = 'message';
+                        let payload = '';
+                        frame.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) eventName = line.slice(7);
+                            else if (line.startsWith('data: ')) payload += line.slice(6);
+                        });
+                        if (!payload) continue;
+                        
+                        const data = JSON.parse(payload);
+                        if (eventName === 'error') {
+                            botDiv.textContent = `❌ Error: ${data.error}`;
+                        } else if (eventName === 'done') {
+                            reply = data.reply;
+                            chatSessionId = data.session_id;
+                            botDiv.textContent = reply;
+                        } else {
+                            reply += data.delta;
+                            botDiv.textContent = reply;
+                        }
+                        chatHistoryDiv.scrollTop = chatHistoryDiv.scrollHeight;
+                    }
                 }
             } catch (error) {
-                // Remove loading message
-                const messages = chatHistoryDiv.querySelectorAll('.chat-message');
-                if (messages.length > 0) {
-                    messages[messages.length - 1].remove();
-                }
-                addChatMessage('bot', `❌ Network Error: ${error.message}`);
+                botDiv.textContent = `❌ Network Error: ${error.message}`;
             }
         }
 
@@ -329,11 +440,12 @@ HTML_TEMPLATE = """
             messageDiv.textContent = message;
             chatHistoryDiv.appendChild(messageDiv);
             chatHistoryDiv.scrollTop = chatHistoryDiv.scrollHeight;
+            return messageDiv;
         }
 
         function clearChat() {
             document.getElementById('chatHistory').innerHTML = '';
-            chatHistory = [];
+            chatSessionId = null;
         }
 
         // Allow Enter key to send messages
@@ -353,54 +465,96 @@ def index():
     """Serve the main web interface"""
     return render_template_string(HTML_TEMPLATE)
 
+def analyze_document(ipfs_hash, force_refresh):
+    # Create agent and task
+    agent = PdfScorerAgent()
+    task = ScorePdfTask(ipfs_hash=ipfs_hash, force_refresh=force_refresh)
+    return agent.run(task)
+
+def run_analysis(ipfs_hash, force_refresh=False):
+    """Analyze one PDF and build the JSON response body shared by /analyze, /analyze/batch and /jobs"""
+    # Requests for a document that is already being analyzed wait for that
+    # analysis instead of downloading and scoring it again
+    try:
+        result, shared = analysis_flight.do((ipfs_hash, force_refresh), analyze_document, ipfs_hash, force_refresh)
+    except Exception:
+        ANALYSES.inc(outcome="error")
+        raise
+    return analysis_response(ipfs_hash, result, shared)
+
+def analysis_response(ipfs_hash, result, shared=False):
+    """JSON body for a finished analysis (shared with the ASGI server)"""
+    ANALYSES.inc(outcome="coalesced" if shared else "stored" if result["cached"] else "analyzed")
+
+    # Clean up the summary text formatting
+    cleaned_summary = clean_text_formatting(result["summary"])
+    
+    return {
+        "status": "success",
+        "ipfs_hash": ipfs_hash,
+        "summary": cleaned_summary,
+        "score": result["score"],
+        "cached": result["cached"],
+        "stages": result["stages"],
+        "timestamp": __import__('datetime').datetime.now().isoformat(),
+        "message": f"PDF analysis completed successfully. Genuineness score: {result['score']}/10"
+    }
+
+def rate_limited_body(error):
+    return {
+        "error": str(error),
+        "status": "error",
+        "message": "The AI service is at capacity. Please retry shortly."
+    }
+
+def retry_after_header(error):
+    return str(max(1, round(error.retry_after)))
+
+def rate_limited_response(error):
+    """429 for a request whose LLM call couldn't get quota in time"""
+    response = jsonify(rate_limited_body(error))
+    response.headers['Retry-After'] = retry_after_header(error)
+    return response, 429
+
 @app.route('/analyze', methods=['POST'])
 def analyze_pdf():
     """API endpoint to analyze PDF from IPFS hash"""
     try:
         # Check if API key is configured
-        if not os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") == "your_gemini_api_key_here":
+        if not llm.backend.configured:
             return jsonify({
                 "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
                 "status": "error"
             }), 500
 
         # Get IPFS hash from request
-        data = request.get_json()
-        if not data or 'ipfs_hash' not in data:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'ipfs_hash' not in data:
             return jsonify({
                 "error": "Missing 'ipfs_hash' in request body",
                 "status": "error"
             }), 400
 
-        ipfs_hash = data['ipfs_hash'].strip()
-        if not ipfs_hash:
+        error = ipfs_hash_error(data['ipfs_hash'])
+        if error:
             return jsonify({
-                "error": "IPFS hash cannot be empty",
+                "error": error,
                 "status": "error"
             }), 400
+        ipfs_hash = data['ipfs_hash'].strip()
 
-        # Create agent and task
-        agent = PdfScorerAgent()
-        task = ScorePdfTask(ipfs_hash=ipfs_hash)
-        
-        # Run the analysis
-        result = agent.run(task)
-        
-        # Clean up the summary text formatting
-        cleaned_summary = clean_text_formatting(result["summary"])
-        
-        # Return JSON formatted response
-        response = {
-            "status": "success",
-            "ipfs_hash": ipfs_hash,
-            "summary": cleaned_summary,
-            "score": result["score"],
-            "timestamp": __import__('datetime').datetime.now().isoformat(),
-            "message": f"PDF analysis completed successfully. Genuineness score: {result['score']}/10"
-        }
+        # Stored results are returned unless the client asks for a fresh analysis
+        force_refresh = parse_flag(data.get('force_refresh'))
+        if force_refresh is None:
+            return invalid_flag_response('force_refresh')
+
+        response = run_analysis(ipfs_hash, force_refresh)
         
         return jsonify(response), 200
 
+    except llm.RateLimited as e:
+        return rate_limited_response(e)
+
     except Exception as e:
         error_message = str(e)
         print(f"Error analyzing PDF: {error_message}")
@@ -413,12 +567,138 @@ def analyze_pdf():
             "timestamp": __import__('datetime').datetime.now().isoformat()
         }), 500
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many IPFS hashes, streaming one NDJSON line per document as it finishes"""
+    if not llm.backend.configured:
+        return jsonify({
+            "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
+            "status": "error"
+        }), 500
+
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('ipfs_hashes'), list):
+        return jsonify({
+            "error": "Missing 'ipfs_hashes' list in request body",
+            "status": "error"
+        }), 400
+
+    # Drop blanks and duplicates, keeping the client's order
+    ipfs_hashes = list(dict.fromkeys(
+        str(ipfs_hash).strip() for ipfs_hash in data['ipfs_hashes'] if str(ipfs_hash).strip()
+    ))
+    if not ipfs_hashes:
+        return jsonify({
+            "error": "No IPFS hashes to analyze",
+            "status": "error"
+        }), 400
+    if len(ipfs_hashes) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "error": f"A batch can contain at most {BATCH_MAX_ITEMS} IPFS hashes",
+            "status": "error"
+        }), 400
+
+    try:
+        concurrency = int(data.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        concurrency = BATCH_CONCURRENCY
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    force_refresh = parse_flag(data.get('force_refresh'))
+    if force_refresh is None:
+        return invalid_flag_response('force_refresh')
+
+    def analyze_one(ipfs_hash):
+        try:
+            return run_analysis(ipfs_hash, force_refresh)
+        except Exception as e:
+            # Report the failure for this item only; the rest of the batch carries on
+            print(f"Error analyzing PDF {ipfs_hash}: {e}")
+            return {
+                "status": "error",
+                "ipfs_hash": ipfs_hash,
+                "error": str(e),
+                "timestamp": __import__('datetime').datetime.now().isoformat()
+            }
+
+    def generate():
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+        futures = [executor.submit(analyze_one, ipfs_hash) for ipfs_hash in ipfs_hashes]
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result()) + "\n"
+        finally:
+            # Client went away or batch finished: drop anything not yet started
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a PDF analysis and return a job id to poll instead of blocking the request"""
+    if not llm.backend.configured:
+        return jsonify({
+            "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
+            "status": "error"
+        }), 500
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'ipfs_hash' not in data:
+        return jsonify({
+            "error": "Missing 'ipfs_hash' in request body",
+            "status": "error"
+        }), 400
+
+    error = ipfs_hash_error(data['ipfs_hash'])
+    if error:
+        return jsonify({
+            "error": error,
+            "status": "error"
+        }), 400
+    ipfs_hash = data['ipfs_hash'].strip()
+
+    force_refresh = parse_flag(data.get('force_refresh'))
+    if force_refresh is None:
+        return invalid_flag_response('force_refresh')
+
+    try:
+        job = job_queue.submit(run_analysis, ipfs_hash, force_refresh)
+    except QueueFull as e:
+        response = jsonify({
+            "error": str(e),
+            "status": "error",
+            "message": "Server is busy. Please retry shortly."
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    return jsonify({
+        "status": "queued",
+        "job_id": job.id,
+        "ipfs_hash": ipfs_hash,
+        "status_url": f"/jobs/{job.id}",
+        "timestamp": __import__('datetime').datetime.now().isoformat()
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the status of a queued analysis, including its result once done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            "error": f"Unknown job id: {job_id}",
+            "status": "error"
+        }), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Web3 Smart Contract Chatbot API endpoint"""
+    started = time.perf_counter()
     try:
         # Check if API key is configured
-        if not GEMINI_API_KEY or GEMINI_API_KEY == "your_gemini_api_key_here":
+        if not llm.backend.configured:
             return jsonify({
                 "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
                 "status": "error"
@@ -439,67 +719,59 @@ def chat():
                 "status": "error"
             }), 400
 
-        # Create full prompt with knowledge base
-        full_prompt = f"""
-You are a helpful AI assistant for a decentralized Web3 application.
-
-The platform includes smart contracts for:
-- Fundraising (FundraiserDApp)
-- Remittance (secure peer-to-peer transfers)
-- Lending pools using a ROSCA model (MultiPoolLoanSystem)
-
-Below is the complete knowledge base of the system contracts:
+        # One snapshot serves the whole request even if the knowledge base is reloaded meanwhile
+        knowledge = knowledge_base.current
 
-{formatted_context}
+        session = chat_sessions.get_or_create(data.get("session_id"))
 
-IMPORTANT FORMATTING RULES:
-- Use ONLY plain text in your response
-- Do NOT use any markdown formatting like **bold**, *italic*, or `code`
-- Do NOT use asterisks (*), quotes ("), backticks (`), or other special characters for formatting
-- Do NOT use numbered lists with special formatting
-- Use simple numbered lists like: 1. First item, 2. Second item
-- Use simple bullet points with dashes: - Item one, - Item two
-- Keep responses clean and readable without any markup
-
-Now, answer the following user query with accurate, simple, and clear instructions in plain text only.
-Be helpful and provide specific details from the knowledge base when relevant.
-If the user asks about functions, explain how to use them.
-If they ask about workflows, walk them through the steps.
-Keep your responses concise but informative.
-
-User: {prompt}
-"""
-
-        # Try to get a working model
-        model_names = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]
-        response_text = None
-        
-        for model_name in model_names:
-            try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(full_prompt)
-                response_text = response.text.strip()
-                
-                # Clean up formatting - remove markdown and special characters
-                response_text = clean_text_formatting(response_text)
-                break
-            except Exception as e:
-                print(f"Model {model_name} failed: {e}")
-                continue
-
-        if response_text is None:
+        # Frequently asked questions are answered from the cache; follow-ups
+        # depend on the conversation, so only opening questions are cached
+        cache_key = (knowledge.version, normalize_question(prompt))
+        cached_reply = None if session.has_history else answer_cache.get(cache_key)
+        if cached_reply is not None:
+            chat_sessions.record(session, prompt, cached_reply)
+            observe_chat("chat", "cached", started)
+            return jsonify({
+                "reply": cached_reply,
+                "session_id": session.session_id,
+                "status": "success",
+                "cached": True,
+                "timestamp": __import__('datetime').datetime.now().isoformat()
+            })
+
+        full_prompt = build_chat_prompt(prompt, knowledge, session)
+
+        # Use the shared model router (skips failing models and hedges slow calls)
+        try:
+            response_text = llm.generate(full_prompt)
+        except llm.RateLimited as e:
+            observe_chat("chat", "rate_limited", started)
+            return rate_limited_response(e)
+        except Exception as e:
+            observe_chat("chat", "error", started)
+            print(f"Chat generation failed: {e}")
             return jsonify({
                 "error": "Failed to generate response. No working model available.",
                 "status": "error"
             }), 500
 
+        # Clean up formatting - remove markdown and special characters
+        response_text = clean_text_formatting(response_text)
+        if not session.has_history:
+            answer_cache.set(cache_key, response_text)
+        chat_sessions.record(session, prompt, response_text)
+        observe_chat("chat", "generated", started)
+
         return jsonify({
             "reply": response_text,
+            "session_id": session.session_id,
             "status": "success",
+            "cached": False,
             "timestamp": __import__('datetime').datetime.now().isoformat()
         })
 
     except Exception as e:
+        observe_chat("chat", "error", started)
         print(f"Chat error: {e}")
         print(traceback.format_exc())
         
@@ -510,14 +782,114 @@ User: {prompt}
             "timestamp": __import__('datetime').datetime.now().isoformat()
         }), 500
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+def sse_event(data, event=None):
+    """Format one server-sent event carrying a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat: relays the reply as server-sent events while it is generated"""
+    if not llm.backend.configured:
+        return jsonify({
+            "error": "GEMINI_API_KEY not configured. Please set it in your .env file.",
+            "status": "error"
+        }), 500
+
+    data = request.get_json(silent=True)
+    if not data or 'prompt' not in data:
+        return jsonify({
+            "error": "Missing 'prompt' in request body",
+            "status": "error"
+        }), 400
+
+    prompt = str(data.get("prompt", "")).strip()
+    if not prompt:
+        return jsonify({
+            "error": "Prompt cannot be empty",
+            "status": "error"
+        }), 400
+
+    started = time.perf_counter()
+    knowledge = knowledge_base.current
+    session = chat_sessions.get_or_create(data.get("session_id"))
+    follow_up = session.has_history
+    cache_key = (knowledge.version, normalize_question(prompt))
+
+    def generate():
+        cached_reply = None if follow_up else answer_cache.get(cache_key)
+        if cached_reply is not None:
+            yield sse_event({"delta": cached_reply})
+            try:
+                yield sse_event({"reply": cached_reply, "session_id": session.session_id, "cached": True}, event="done")
+            finally:
+                observe_chat("chat_stream", "cached", started)
+                chat_sessions.record(session, prompt, cached_reply)
+            return
+
+        cleaner = StreamingCleaner()
+        pieces = []
+        try:
+            for chunk in llm.stream(build_chat_prompt(prompt, knowledge, session)):
+                piece = cleaner.feed(chunk)
+                if piece:
+                    pieces.append(piece)
+                    yield sse_event({"delta": piece})
+            piece = cleaner.flush()
+            if piece:
+                pieces.append(piece)
+                yield sse_event({"delta": piece})
+        except llm.RateLimited as e:
+            observe_chat("chat_stream", "rate_limited", started)
+            yield sse_event({"error": str(e), "status": "error", "retry_after": round(e.retry_after)}, event="error")
+            return
+        except Exception as e:
+            observe_chat("chat_stream", "error", started)
+            print(f"Chat stream error: {e}")
+            yield sse_event({"error": str(e), "status": "error"}, event="error")
+            return
+
+        reply = "".join(pieces)
+        if not follow_up:
+            answer_cache.set(cache_key, reply)
+        # The turn is recorded after the client has the reply
+        try:
+            yield sse_event({"reply": reply, "session_id": session.session_id, "cached": False}, event="done")
+        finally:
+            observe_chat("chat_stream", "generated", started)
+            chat_sessions.record(session, prompt, reply)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        # Stop reverse proxies from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def health_status():
+    """Body of /health (shared with the ASGI server)"""
+    return {
         "status": "healthy",
         "message": "PDF Verification Agent is running",
+        "jobs": job_queue.stats(),
+        "analysis_coalescing": analysis_flight.stats(),
+        "chat_cache": answer_cache.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "models": llm.registry.stats(),
+        "llm_limiter": llm.limiter.stats() if llm.limiter else None,
+        "latency": metrics.REGISTRY.rolling_summary(),
         "timestamp": __import__('datetime').datetime.now().isoformat()
-    })
+    }
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify(health_status())
 
 if __name__ == '__main__':
     print("🚀 Starting AI Services Platform...")
@@ -527,18 +899,24 @@ if __name__ == '__main__':
     print("\n🌐 Server will be available at:")
     print("   • Web Interface: http://localhost:5000")
     print("   • PDF Analysis API: http://localhost:5000/analyze")
+    print("   • Batch PDF Analysis API: http://localhost:5000/analyze/batch")
+    print("   • Async PDF Analysis Jobs: http://localhost:5000/jobs")
     print("   • Web3 Chatbot API: http://localhost:5000/api/chat")
+    print("   • Web3 Chatbot Streaming API: http://localhost:5000/api/chat/stream")
     print("   • Health Check: http://localhost:5000/health")
+    print("   • Prometheus Metrics: http://localhost:5000/metrics")
     print("\n📖 API Usage:")
     print("   PDF Analysis:")
     print("   POST /analyze")
-    print("   Body: {\"ipfs_hash\": \"QmYourHashHere\"}")
+    print("   Body: {\"ipfs_hash\": \"QmYourHashHere\", \"force_refresh\": false}")
     print("\n   Web3 Chatbot:")
     print("   POST /api/chat") 
     print("   Body: {\"prompt\": \"Your question about smart contracts\"}")
     print("\n⚠️  SECURITY NOTE: This is a development server.")
     print("   For production, use a proper WSGI server (gunicorn, uwsgi)")
     
+    tools.prune_results()
+
     # For production, set debug=False
     DEBUG_MODE = os.getenv('FLASK_ENV') != 'production'
     app.run(host='0.0.0.0', port=5000, debug=DEBUG_MODE)
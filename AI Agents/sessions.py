@@ -0,0 +1,220 @@
+"""
+Server-side chat sessions for the Web3 chatbot.
+
+Each session keeps its most recent turns verbatim and rolls older turns into
+a running summary, so the history sent with a prompt stays within a fixed
+character budget however long the conversation runs. Summaries are written
+in the background, so a reply never waits for one. Sessions live in an LRU
+store capped by total size and expire after an idle timeout.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads writing running summaries (each call may wait on the LLM)
+SUMMARY_WORKERS = 4
+
+
+def _size(text):
+    return len(text.encode("utf-8"))
+
+
+def format_turns(turns):
+    return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def truncate_summary(text, max_chars):
+    """Keep the most recent max_chars characters of a summary, cut at a word boundary"""
+    if len(text) <= max_chars:
+        return text
+    text = text[-max_chars:]
+    space = text.find(" ")
+    return text[space + 1:] if 0 <= space < 40 else text
+
+
+def extractive_summary(summary, turns, max_chars):
+    """Fallback summarizer: append the rolled-off turns and keep the most recent part"""
+    combined = " ".join(part for part in [summary, format_turns(turns).replace("\n", " ")] if part)
+    return truncate_summary(combined, max_chars)
+
+
+class ChatSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.summary = ""
+        self.turns = []
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+        self.compacting = False
+        # Size last added to the store's running total
+        self.counted_bytes = 0
+
+    @property
+    def size(self):
+        return _size(self.summary) + sum(_size(q) + _size(a) for q, a in self.turns)
+
+    @property
+    def has_history(self):
+        return bool(self.summary or self.turns)
+
+    def last_question(self):
+        with self.lock:
+            return self.turns[-1][0] if self.turns else ""
+
+    def history(self, max_chars):
+        """Running summary plus as many recent turns as fit in max_chars"""
+        with self.lock:
+            summary, turns = self.summary, list(self.turns)
+        recent, used = [], len(summary)
+        for turn in reversed(turns):
+            size = len(format_turns([turn])) + 1
+            if used + size > max_chars:
+                break
+            recent.insert(0, turn)
+            used += size
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary}")
+        if recent:
+            parts.append(format_turns(recent))
+        return "\n".join(parts)
+
+
+class SessionStore:
+    """Thread-safe LRU of chat sessions bounded by total size and idle time
+
+    summarize(previous_summary, turns, max_chars) folds rolled-off turns into
+    the running summary; it runs on a background thread and falls back to an
+    extractive summary if it fails. Until it finishes, the rolled-off turns
+    stay in the session and history() leaves out whatever no longer fits.
+    """
+
+    def __init__(self, max_bytes, ttl, history_chars, summary_chars, summarize=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.history_chars = history_chars
+        self.summary_chars = summary_chars
+        self.summarize = summarize
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.compactions = 0
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get_or_create(self, session_id=None):
+        """Live session for session_id, or a new session if it is unknown or expired"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ChatSession(secrets.token_urlsafe(16))
+                self._sessions[session.session_id] = session
+                self.created += 1
+            session.last_access = now
+            self._sessions.move_to_end(session.session_id)
+            return session
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+            return self._executor
+
+    def record(self, session, question, answer):
+        """Append a turn; once over budget the oldest turns are compacted into the summary in the background"""
+        with session.lock:
+            session.turns.append((question, answer))
+            session.last_access = time.monotonic()
+            overflow = self._overflow(session)
+            if overflow:
+                session.compacting = True
+            previous = session.summary
+        self._update_size(session)
+        if overflow:
+            if self.summarize:
+                self._get_executor().submit(self._compact, session, previous, overflow)
+            else:
+                self._compact(session, previous, overflow)
+
+    def _compact(self, session, previous, overflow):
+        """Fold the overflow turns into the session's summary, again if more turns overflowed meanwhile"""
+        while overflow:
+            summary = None
+            if self.summarize:
+                try:
+                    summary = self.summarize(previous, overflow, self.summary_chars)
+                except Exception as e:
+                    print(f"Chat summary failed, keeping an extractive summary: {e}")
+            if not summary:
+                summary = extractive_summary(previous, overflow, self.summary_chars)
+            with session.lock:
+                session.summary = truncate_summary(summary.strip(), self.summary_chars)
+                del session.turns[:len(overflow)]
+                session.compacting = False
+                overflow = self._overflow(session)
+                session.compacting = bool(overflow)
+                previous = session.summary
+            with self._lock:
+                self.compactions += 1
+            self._update_size(session)
+
+    def _update_size(self, session):
+        """Bring the running total up to date with session's size, then evict down to max_bytes"""
+        with self._lock:
+            # A session that was already evicted or expired no longer counts
+            if self._sessions.get(session.session_id) is session:
+                with session.lock:
+                    size = session.size
+                self._bytes += size - session.counted_bytes
+                session.counted_bytes = size
+            self._evict()
+
+    def _overflow(self, session):
+        """Oldest turns that no longer fit the verbatim history budget (caller holds session.lock)"""
+        if session.compacting:
+            return []
+        budget = self.history_chars - self.summary_chars
+        used = 0
+        keep = 0
+        for turn in reversed(session.turns):
+            used += len(format_turns([turn])) + 1
+            if used > budget and keep:
+                break
+            keep += 1
+        return list(session.turns[:len(session.turns) - keep])
+
+    def _expire(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= session.counted_bytes
+            self.expirations += 1
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            self._bytes -= session.counted_bytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "idle_ttl_seconds": self.ttl,
+                "created": self.created,
+                "expired": self.expirations,
+                "evicted": self.evictions,
+                "compactions": self.compactions,
+            }
@@ -0,0 +1,99 @@
+"""
+Coalescing of concurrent duplicate work ("single flight").
+
+The first caller for a key runs the work; callers that arrive while it is in
+flight wait for its outcome instead of repeating it. The result, or the
+exception, is handed to every waiter and then forgotten, so nothing is cached
+here and a call after a failure starts a fresh attempt.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Single flight for threads"""
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Run func(*args) unless a call for key is in flight; returns (result, shared)
+
+        shared is True for callers that received another caller's result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+class AsyncSingleFlight:
+    """Single flight for coroutines on one event loop
+
+    The work runs as its own task and callers await it through a shield, so a
+    client that disconnects doesn't cancel the work for the others.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._tasks = {}
+
+    async def do(self, key, func, *args):
+        """Await func(*args) unless a call for key is in flight; returns (result, shared)"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func(*args))
+            self._tasks[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every waiter went away
+            task.exception()
+
+    def stats(self):
+        return {"in_flight": len(self._tasks), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -1,16 +1,81 @@
+import tools
+from pipeline import Stage
+
+
 class ScorePdfTask:
-    def __init__(self, ipfs_hash: str):
+    def __init__(self, ipfs_hash: str, force_refresh: bool = False, combined: bool = True):
         self.name = "ScorePdfTask"
         self.description = "Download, summarize, and score PDF"
         self.ipfs_hash = ipfs_hash
+        self.force_refresh = force_refresh
+        # One structured call for summary and score instead of two
+        self.combined = combined
+
+    def stages(self, agent):
+        """Stage graph: download -> extract -> analyze (or summarize and score in parallel)
+
+        In the default combined mode the graph is a chain, since each stage needs
+        the previous one's output; its concurrency is inside analyze, which runs a
+        long document's chunks in parallel. The graph only branches when
+        combined=False.
+        """
+        stages = [Stage("download", lambda inputs: agent.download_pdf(self.ipfs_hash))]
+        if self.combined:
+            # Long documents are analyzed chunk by chunk, up to ANALYSIS_MAX_CHARS
+            stages.append(Stage("extract", lambda inputs: agent.extract_pages(inputs["download"], tools.ANALYSIS_MAX_CHARS), ["download"]))
+            stages.append(Stage("analyze", lambda inputs: agent.analyze_document(inputs["extract"]), ["extract"]))
+        else:
+            # The separate prompts only use the first TEXT_LIMIT characters, so don't parse past them
+            stages.append(Stage("extract", lambda inputs: agent.extract_text(inputs["download"], tools.TEXT_LIMIT), ["download"]))
+            stages.append(Stage("summarize", lambda inputs: agent.summarize_with_model(inputs["extract"]), ["extract"]))
+            stages.append(Stage("score", lambda inputs: agent.score_with_model(inputs["extract"]), ["extract"]))
+        return stages
+
+    def astages(self, agent):
+        """stages() with the agent's async methods, for arun()"""
+        stages = [Stage("download", lambda inputs: agent.adownload_pdf(self.ipfs_hash))]
+        if self.combined:
+            stages.append(Stage("extract", lambda inputs: agent.aextract_pages(inputs["download"], tools.ANALYSIS_MAX_CHARS), ["download"]))
+            stages.append(Stage("analyze", lambda inputs: agent.aanalyze_document(inputs["extract"]), ["extract"]))
+        else:
+            stages.append(Stage("extract", lambda inputs: agent.aextract_text(inputs["download"], tools.TEXT_LIMIT), ["download"]))
+            stages.append(Stage("summarize", lambda inputs: agent.asummarize_with_model(inputs["extract"]), ["extract"]))
+            stages.append(Stage("score", lambda inputs: agent.ascore_with_model(inputs["extract"]), ["extract"]))
+        return stages
+
+    def _result(self, run):
+        """The task's result and the model that produced it"""
+        if self.combined:
+            result = dict(run.outputs["analyze"])
+            return result, result.pop("model")
+        summary, summary_model = run.outputs["summarize"]
+        score, score_model = run.outputs["score"]
+        return {"summary": summary, "score": score}, tools.answered_by(summary_model, score_model)
+
+    @staticmethod
+    def _timings(run):
+        return {name: round(seconds, 4) for name, seconds in run.timings.items()}
 
     def run(self, agent):
         """Execute the task using the provided agent"""
-        file_path = agent.download_pdf(self.ipfs_hash)
-        text = agent.extract_text(file_path)
-        summary = agent.summarize(text)
-        score = agent.score(text)
-        return {
-            "summary": summary,
-            "score": score
-        }
+        if not self.force_refresh:
+            cached = agent.load_result(self.ipfs_hash, self.combined)
+            if cached:
+                return dict(cached, cached=True, stages={})
+
+        run = agent.run_stages(self.stages(agent))
+        result, model_name = self._result(run)
+        agent.save_result(self.ipfs_hash, result, model_name, self.combined)
+        return dict(result, cached=False, stages=self._timings(run))
+
+    async def arun(self, agent):
+        """run() for asyncio callers, returning the same result"""
+        if not self.force_refresh:
+            cached = await agent.aload_result(self.ipfs_hash, self.combined)
+            if cached:
+                return dict(cached, cached=True, stages={})
+
+        run = await agent.arun_stages(self.astages(agent))
+        result, model_name = self._result(run)
+        await agent.asave_result(self.ipfs_hash, result, model_name, self.combined)
+        return dict(result, cached=False, stages=self._timings(run))
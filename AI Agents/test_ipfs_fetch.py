@@ -0,0 +1,102 @@
+"""
+Gateway ranking checks for ipfs_fetch against local stand-in gateways (no network needed).
+"""
+
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipfs_fetch import GatewayFetcher, _abort, create_session
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 4096 + b"\n%%EOF\n"
+
+
+def start_gateway(delay=0.0, drip=False):
+    """Serve PDF_BYTES for any path after delay seconds; drip sends one byte per delay forever"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not drip:
+                time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(PDF_BYTES)))
+            self.end_headers()
+            try:
+                if drip:
+                    for byte in PDF_BYTES:
+                        self.wfile.write(bytes([byte]))
+                        self.wfile.flush()
+                        time.sleep(delay)
+                else:
+                    self.wfile.write(PDF_BYTES)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}/ipfs/{{cid}}"
+
+
+def test_slow_gateway_drops_in_ranking():
+    """A gateway that keeps losing the race ranks behind the one that wins it"""
+    slow_server, slow = start_gateway(delay=0.3)
+    fast_server, fast = start_gateway()
+    try:
+        # The slow gateway is listed first, so only the ranking can move it back
+        fetcher = GatewayFetcher([slow, fast], max_bytes=1024 * 1024, race_width=2, timeout=5)
+        with tempfile.TemporaryDirectory() as dest_dir:
+            for _ in range(3):
+                fetcher.fetch("QmRankingTest", dest_dir)
+        stats = fetcher.latency_stats()
+        print(f"📊 Latency: slow={stats[slow]:.3f}s fast={stats[fast]:.3f}s")
+        assert fetcher.ranked_gateways() == [fast, slow]
+        assert stats[slow] > stats[fast]
+        print("✅ Slow gateway dropped behind the fast one")
+    finally:
+        slow_server.shutdown()
+        fast_server.shutdown()
+
+
+def test_dripping_gateway_hits_deadline():
+    """A gateway that drips bytes can't hold a fetch past the timeout"""
+    drip_server, drip = start_gateway(delay=0.1, drip=True)
+    try:
+        fetcher = GatewayFetcher([drip], max_bytes=1024 * 1024, timeout=1)
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory() as dest_dir:
+            try:
+                fetcher.fetch("QmDeadlineTest", dest_dir)
+            except Exception as e:
+                print(f"⏱️  {str(e)[:120]}")
+            else:
+                raise AssertionError("Dripping gateway should not complete")
+        elapsed = time.monotonic() - started
+        assert elapsed < 2, f"fetch took {elapsed:.2f}s"
+        print(f"✅ Fetch gave up after {elapsed:.2f}s (timeout 1s)")
+    finally:
+        drip_server.shutdown()
+
+
+def test_abort_finished_download():
+    """Aborting a loser that already finished is a no-op, not an error that fails the race"""
+    server, gateway = start_gateway()
+    try:
+        response = create_session().get(gateway.format(cid="QmAbortTest"), stream=True, timeout=5)
+        assert response.raw.read() == PDF_BYTES
+        _abort(response)
+        response.close()
+        _abort(response)
+        print("✅ Aborting a finished download is harmless")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    print("🧪 Testing IPFS gateway ranking...")
+    test_slow_gateway_drops_in_ranking()
+    test_dripping_gateway_hits_deadline()
+    test_abort_finished_download()
@@ -0,0 +1,87 @@
+"""
+Model router checks for llm.ModelRegistry against the offline stub backend (no API key needed).
+"""
+
+import time
+from llm import BREAKER_FAILURES, HEDGE_MIN_SAMPLES, ModelRegistry
+from llm_backends import StubBackend
+
+
+class SlowModelBackend(StubBackend):
+    """Stub whose models in slow take an extra second per call"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.slow = set()
+
+    def generate(self, model_name, prompt, **kwargs):
+        if model_name in self.slow:
+            time.sleep(1.0)
+        return super().generate(model_name, prompt, **kwargs)
+
+
+def test_breaker_routes_around_failing_model():
+    """A model that keeps failing is moved behind the healthy one"""
+    backend = StubBackend(failing_models=["model-a"])
+    registry = ModelRegistry(["model-a", "model-b"], backend)
+    for _ in range(BREAKER_FAILURES):
+        text, model_name = registry.generate_with_model("What is a DAO?")
+        assert model_name == "model-b"
+    assert registry.stats()["model-a"]["state"] == "open"
+    assert registry.candidates() == ["model-b", "model-a"]
+    calls = backend.calls
+    registry.generate("What is a DAO?")
+    assert backend.calls == calls + 1, "an open breaker should be skipped"
+    print("✅ Breaker opened on the failing model and calls skip it")
+
+
+def test_rate_limits_leave_breaker_closed():
+    """429s are quota, not model health, so they don't open breakers"""
+    registry = ModelRegistry(["model-a", "model-b"], StubBackend(rate_limit_rate=1.0))
+    for _ in range(BREAKER_FAILURES + 1):
+        try:
+            registry.generate("What is a DAO?")
+        except Exception:
+            pass
+    stats = registry.stats()
+    assert all(health["state"] == "closed" for health in stats.values()), stats
+    assert stats["model-a"]["rate_limited"] == BREAKER_FAILURES + 1
+    print("✅ Rate-limited calls left every breaker closed")
+
+
+def test_slow_call_is_hedged():
+    """A call slower than the model's p95 gets a hedged request to the next model"""
+    backend = SlowModelBackend(latency="fixed:0.01")
+    registry = ModelRegistry(["model-a", "model-b"], backend)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        registry.generate("warm up")
+    backend.slow.add("model-a")
+    started = time.monotonic()
+    text, model_name = registry.generate_with_model("What is a DAO?")
+    elapsed = time.monotonic() - started
+    assert model_name == "model-b"
+    assert elapsed < 0.5, f"hedged call took {elapsed:.2f}s"
+    assert registry.stats()["model-a"]["hedges"] == 1
+    print(f"✅ Slow call hedged and answered in {elapsed:.2f}s")
+
+
+def test_streams_leave_hedge_threshold_alone():
+    """Time to first chunk must not drag down the p95 that generate() hedges on"""
+    backend = StubBackend(latency="fixed:0.4")
+    registry = ModelRegistry(["model-a", "model-b"], backend)
+    for _ in range(HEDGE_MIN_SAMPLES + 5):
+        assert "".join(registry.stream("What is a DAO?"))
+    assert registry.stats()["model-a"]["calls"] == HEDGE_MIN_SAMPLES + 5
+    calls = backend.calls
+    for _ in range(5):
+        registry.generate("What is a DAO?")
+    assert backend.calls == calls + 5, f"{backend.calls - calls} backend calls for 5 generate() calls"
+    print("✅ Streams counted for the breaker without triggering hedges")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the model router...")
+    test_breaker_routes_around_failing_model()
+    test_rate_limits_leave_breaker_closed()
+    test_slow_call_is_hedged()
+    test_streams_leave_hedge_threshold_alone()
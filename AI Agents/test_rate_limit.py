@@ -0,0 +1,140 @@
+"""
+Admission control checks for rate_limit.AdmissionController (no API key needed).
+"""
+
+import asyncio
+import threading
+import time
+from rate_limit import BULK, INTERACTIVE, AdmissionController, RateLimited
+
+TOKENS = 100
+
+
+def make_limiter(requests_per_minute=60, max_waiting=10, max_wait=5.0, bulk_reserve=0.2):
+    return AdmissionController(requests_per_minute, 1000000, max_waiting, max_wait, bulk_reserve)
+
+
+def test_bulk_leaves_interactive_reserve():
+    """Bulk calls stop at the reserve while interactive calls can still use it"""
+    limiter = make_limiter()
+    assert limiter.bulk_burst() == 8
+    for _ in range(limiter.bulk_burst()):
+        limiter.acquire(TOKENS, BULK, block=False)
+    try:
+        limiter.acquire(TOKENS, BULK, block=False)
+        raise AssertionError("bulk call drew the bucket into the reserve")
+    except RateLimited as e:
+        assert e.retry_after > 0
+    limiter.acquire(TOKENS, INTERACTIVE, block=False)
+    assert limiter.stats()["admitted"] == {INTERACTIVE: 1, BULK: 8}
+    print("✅ Bulk calls left the reserve to interactive ones")
+
+
+def test_interactive_admitted_ahead_of_bulk():
+    """A waiting interactive call goes first even when bulk started waiting earlier"""
+    limiter = make_limiter(requests_per_minute=300, bulk_reserve=0)
+    limiter.requests.level = 0
+    order = []
+
+    def call(lane):
+        limiter.acquire(TOKENS, lane)
+        order.append(lane)
+
+    bulk = threading.Thread(target=call, args=(BULK,))
+    bulk.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+    interactive.start()
+    bulk.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BULK], order
+    print("✅ Interactive call admitted ahead of the earlier bulk call")
+
+
+def test_async_interactive_admitted_ahead_of_bulk():
+    """acquire_async() honours the same lane order"""
+    limiter = make_limiter(requests_per_minute=300, bulk_reserve=0)
+    limiter.requests.level = 0
+    order = []
+
+    async def call(lane, delay):
+        await asyncio.sleep(delay)
+        await limiter.acquire_async(TOKENS, lane)
+        order.append(lane)
+
+    async def main():
+        await asyncio.gather(call(BULK, 0), call(INTERACTIVE, 0.05))
+
+    asyncio.run(main())
+    assert order == [INTERACTIVE, BULK], order
+    print("✅ Async interactive call admitted ahead of the earlier bulk call")
+
+
+def _ignore_rate_limited(limiter):
+    try:
+        limiter.acquire(TOKENS)
+    except RateLimited:
+        pass
+
+
+def test_full_queue_rejects():
+    """A caller is refused at once when max_waiting callers are already queued"""
+    limiter = make_limiter(max_waiting=1, max_wait=0.5)
+    limiter.requests.level = 0
+    waiter = threading.Thread(target=_ignore_rate_limited, args=(limiter,))
+    waiter.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    try:
+        limiter.acquire(TOKENS)
+        raise AssertionError("call was queued past max_waiting")
+    except RateLimited as e:
+        assert "Too many" in str(e)
+    assert time.monotonic() - started < 0.1
+    waiter.join()
+    assert limiter.stats()["rejected"][INTERACTIVE] == 2
+    print("✅ Full wait queue rejected the extra caller without waiting")
+
+
+def test_wait_times_out():
+    """A caller that can't be admitted within max_wait gets RateLimited"""
+    limiter = make_limiter(max_wait=0.1)
+    limiter.requests.level = 0
+    started = time.monotonic()
+    try:
+        limiter.acquire(TOKENS)
+        raise AssertionError("call admitted with an empty bucket")
+    except RateLimited as e:
+        assert "Timed out" in str(e)
+        assert e.retry_after >= 1.0
+    elapsed = time.monotonic() - started
+    assert 0.1 <= elapsed < 0.3, elapsed
+    assert limiter.stats()["waiting"] == {INTERACTIVE: 0, BULK: 0}
+    print(f"✅ Waiting call timed out after {elapsed:.2f}s")
+
+
+def test_backoff_pauses_admissions():
+    """After a 429 nothing is admitted until the pause is over"""
+    limiter = make_limiter()
+    limiter.backoff(0.3)
+    try:
+        limiter.acquire(TOKENS, block=False)
+        raise AssertionError("call admitted during a backoff pause")
+    except RateLimited as e:
+        assert 0 < e.retry_after <= 0.3
+    started = time.monotonic()
+    limiter.acquire(TOKENS)
+    elapsed = time.monotonic() - started
+    assert 0.2 <= elapsed < 0.5, elapsed
+    assert limiter.stats()["throttled"] == 1
+    print(f"✅ Backoff held the next call for {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing LLM admission control...")
+    test_bulk_leaves_interactive_reserve()
+    test_interactive_admitted_ahead_of_bulk()
+    test_async_interactive_admitted_ahead_of_bulk()
+    test_full_queue_rejects()
+    test_wait_times_out()
+    test_backoff_pauses_admissions()
@@ -0,0 +1,128 @@
+"""
+Chat session checks for sessions.SessionStore: compaction, size accounting, eviction and expiry.
+"""
+
+import threading
+import time
+from sessions import SessionStore
+
+HISTORY_CHARS = 300
+SUMMARY_CHARS = 100
+
+
+def make_store(max_bytes=100000, ttl=60, summarize=None):
+    return SessionStore(max_bytes, ttl, HISTORY_CHARS, SUMMARY_CHARS, summarize)
+
+
+def chat(store, session, turns, prefix="Question"):
+    for i in range(turns):
+        store.record(session, f"{prefix} {i} about DAOs?", f"Answer {i}: a DAO is an organization run by code.")
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out waiting for the session store"
+        time.sleep(0.01)
+
+
+def test_history_stays_within_budget():
+    """Old turns roll into the summary and history() fits the budget"""
+    store = make_store()
+    session = store.get_or_create()
+    chat(store, session, 20)
+    history = session.history(HISTORY_CHARS)
+    assert store.stats()["compactions"] > 0
+    assert session.summary and len(session.summary) <= SUMMARY_CHARS
+    assert "Question 19 about DAOs?" in history
+    assert len(history) <= HISTORY_CHARS + len("Summary of earlier conversation: \n"), len(history)
+    print(f"✅ 20 turns kept in a {len(history)} character history")
+
+
+def test_compaction_runs_in_background():
+    """record() doesn't wait for the summarizer, and its summary is used once ready"""
+    release = threading.Event()
+    calls = []
+
+    def summarize(previous, turns, max_chars):
+        calls.append(len(turns))
+        release.wait(2)
+        return "The user asked about DAOs."
+
+    store = make_store(summarize=summarize)
+    session = store.get_or_create()
+    started = time.monotonic()
+    chat(store, session, 10)
+    elapsed = time.monotonic() - started
+    assert elapsed < 0.5, f"record() waited {elapsed:.2f}s for the summarizer"
+    assert len(calls) == 1, "a second compaction started while one was running"
+    release.set()
+    wait_for(lambda: not session.compacting)
+    assert session.summary == "The user asked about DAOs."
+    assert session.turns[-1][0] == "Question 9 about DAOs?"
+    print(f"✅ 10 turns recorded in {elapsed:.2f}s while the summary was written")
+
+
+def test_failed_summary_falls_back_to_extractive():
+    """A summarizer error leaves an extractive summary instead of losing the turns"""
+    def summarize(previous, turns, max_chars):
+        raise RuntimeError("LLM unavailable")
+
+    store = make_store(summarize=summarize)
+    session = store.get_or_create()
+    chat(store, session, 10)
+    wait_for(lambda: store.stats()["compactions"] > 0 and not session.compacting)
+    assert "a DAO is an organization" in session.summary
+    assert len(session.summary) <= SUMMARY_CHARS
+    print("✅ Failed summary replaced by an extractive one")
+
+
+def test_size_is_tracked():
+    """The store's byte total follows its sessions through compaction"""
+    store = make_store()
+    sessions = [store.get_or_create() for _ in range(3)]
+    for session in sessions:
+        chat(store, session, 12)
+    assert store.stats()["bytes"] == sum(session.size for session in sessions)
+    print(f"✅ Byte total matches {len(sessions)} sessions")
+
+
+def test_least_recently_used_session_is_evicted():
+    """Over max_bytes the least recently used session goes first"""
+    store = make_store()
+    first = store.get_or_create()
+    chat(store, first, 3)
+    second = store.get_or_create()
+    chat(store, second, 3)
+    store.max_bytes = store.stats()["bytes"] + 50
+    assert store.get_or_create(first.session_id) is first
+    third = store.get_or_create()
+    chat(store, third, 1)
+    stats = store.stats()
+    assert stats["evicted"] == 1 and stats["sessions"] == 2
+    assert stats["bytes"] <= store.max_bytes
+    assert store.get_or_create(first.session_id) is first
+    assert store.get_or_create(second.session_id) is not second
+    print("✅ Least recently used session evicted to stay under max_bytes")
+
+
+def test_idle_sessions_expire():
+    """A session idle past the TTL is dropped and its id starts a new session"""
+    store = make_store(ttl=0.1)
+    session = store.get_or_create()
+    chat(store, session, 2)
+    time.sleep(0.2)
+    stats = store.stats()
+    assert stats["sessions"] == 0 and stats["expired"] == 1 and stats["bytes"] == 0
+    assert store.get_or_create(session.session_id).session_id != session.session_id
+    print("✅ Idle session expired")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing chat sessions...")
+    test_history_stays_within_budget()
+    test_compaction_runs_in_background()
+    test_failed_summary_falls_back_to_extractive()
+    test_size_is_tracked()
+    test_least_recently_used_session_is_evicted()
+    test_idle_sessions_expire()
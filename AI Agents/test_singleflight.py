@@ -0,0 +1,117 @@
+"""
+Coalescing checks for singleflight.SingleFlight and AsyncSingleFlight, with the stub backend as the work.
+"""
+
+import asyncio
+import threading
+from llm_backends import StubBackend
+from singleflight import AsyncSingleFlight, SingleFlight
+
+CALLERS = 5
+
+
+def test_concurrent_callers_share_one_call():
+    """Callers that arrive while the work is in flight get the leader's result"""
+    backend = StubBackend(latency="fixed:0.2")
+    flight = SingleFlight()
+    barrier = threading.Barrier(CALLERS)
+    outcomes = []
+
+    def call():
+        barrier.wait()
+        outcomes.append(flight.do("QmA", backend.generate, "model-a", "Analyze QmA"))
+
+    threads = [threading.Thread(target=call) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 1, f"{backend.calls} backend calls"
+    assert len({completion.text for completion, shared in outcomes}) == 1
+    assert sorted(shared for completion, shared in outcomes) == [False] + [True] * (CALLERS - 1)
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": CALLERS - 1}
+    print(f"✅ {CALLERS} concurrent callers shared one backend call")
+
+
+def test_failure_reaches_waiters_and_is_not_kept():
+    """Every waiter sees the leader's exception and the next call starts fresh"""
+    backend = StubBackend(latency="fixed:0.2", failing_models=["model-a"])
+    flight = SingleFlight()
+    barrier = threading.Barrier(CALLERS)
+    errors = []
+
+    def call():
+        barrier.wait()
+        try:
+            flight.do("QmA", backend.generate, "model-a", "Analyze QmA")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 1
+    assert len(errors) == CALLERS and len({id(e) for e in errors}) == 1
+    completion, shared = flight.do("QmA", backend.generate, "model-b", "Analyze QmA")
+    assert not shared and backend.calls == 2
+    print("✅ Failure handed to every waiter and not remembered")
+
+
+def test_different_keys_run_separately():
+    """Only calls for the same key are coalesced"""
+    backend = StubBackend(latency="fixed:0.1")
+    flight = SingleFlight()
+    threads = [threading.Thread(target=flight.do, args=(key, backend.generate, "model-a", key))
+               for key in ("QmA", "QmB")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 2
+    assert flight.stats()["coalesced"] == 0
+    print("✅ Different keys ran their own calls")
+
+
+def test_async_callers_share_one_call():
+    """AsyncSingleFlight coalesces coroutines on one loop"""
+    backend = StubBackend(latency="fixed:0.1")
+    flight = AsyncSingleFlight()
+
+    async def main():
+        return await asyncio.gather(*[flight.do("QmA", backend.agenerate, "model-a", "Analyze QmA")
+                                      for _ in range(CALLERS)])
+
+    outcomes = asyncio.run(main())
+    assert backend.calls == 1
+    assert [shared for completion, shared in outcomes] == [False] + [True] * (CALLERS - 1)
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": CALLERS - 1}
+    print(f"✅ {CALLERS} coroutines shared one backend call")
+
+
+def test_async_cancelled_caller_leaves_work_running():
+    """A caller that goes away doesn't cancel the work the others are waiting for"""
+    backend = StubBackend(latency="fixed:0.2")
+    flight = AsyncSingleFlight()
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("QmA", backend.agenerate, "model-a", "Analyze QmA"))
+        second = asyncio.ensure_future(flight.do("QmA", backend.agenerate, "model-a", "Analyze QmA"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second
+
+    completion, shared = asyncio.run(main())
+    assert shared and completion.text
+    assert backend.calls == 1
+    print("✅ Cancelled caller left the shared work running")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing single-flight coalescing...")
+    test_concurrent_callers_share_one_call()
+    test_failure_reaches_waiters_and_is_not_kept()
+    test_different_keys_run_separately()
+    test_async_callers_share_one_call()
+    test_async_cancelled_caller_leaves_work_running()
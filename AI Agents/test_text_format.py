@@ -0,0 +1,80 @@
+"""
+Chunk-boundary checks for text_format.StreamingCleaner against the golden corpus.
+"""
+
+import json
+import os
+from text_format import StreamingCleaner, clean_text_formatting
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "clean_text_corpus.json")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [case["input"] for case in json.load(f)]
+
+
+def stream(chunks):
+    """Cleaned pieces for chunks, including the final flush()"""
+    cleaner = StreamingCleaner()
+    pieces = [cleaner.feed(chunk) for chunk in chunks]
+    pieces.append(cleaner.flush())
+    return pieces
+
+
+def test_every_split_matches_one_shot():
+    """Splitting a reply at any position gives the same text as cleaning it whole"""
+    for text in load_corpus():
+        expected = clean_text_formatting(text)
+        for split in range(len(text) + 1):
+            actual = "".join(stream([text[:split], text[split:]]))
+            assert actual == expected, f"split at {split} of {text!r}: {actual!r}"
+    print("✅ Every two-chunk split of the corpus matches the one-shot cleanup")
+
+
+def test_character_stream_matches_one_shot():
+    """A reply streamed one character at a time matches the one-shot cleanup"""
+    for text in load_corpus():
+        assert "".join(stream(list(text))) == clean_text_formatting(text), text
+    print("✅ Character-by-character streams of the corpus match the one-shot cleanup")
+
+
+def test_open_markup_is_held_back():
+    """Text inside unclosed markup waits for the closing marker"""
+    cleaner = StreamingCleaner()
+    assert cleaner.feed("Call the **create") == "Call th"
+    assert cleaner.feed("Fundraiser") == ""
+    assert cleaner.feed("** function now") == "e createFundraiser function no"
+    assert cleaner.flush() == "w"
+    print("✅ Bold text held back until it was closed")
+
+
+def test_plain_text_is_released():
+    """Plain text is shown as it arrives, keeping only the word in progress"""
+    cleaner = StreamingCleaner()
+    assert cleaner.feed("A DAO is run by sm") == "A DAO is run by s"
+    assert cleaner.feed("art contracts") == "mart contract"
+    assert cleaner.flush() == "s"
+    print("✅ Plain text released without waiting for the end of the stream")
+
+
+def test_unpaired_apostrophe_holds_back_the_rest():
+    """Text after an apostrophe waits until a second one pairs it or the stream ends"""
+    cleaner = StreamingCleaner()
+    assert cleaner.feed("It's easy to join") == "I"
+    assert cleaner.feed(" a DAO today") == ""
+    assert cleaner.flush() == "t's easy to join a DAO today"
+    cleaner = StreamingCleaner()
+    assert cleaner.feed("It's easy. Don") == "I"
+    assert cleaner.feed("'t worry") == "ts easy. Dont worr"
+    assert cleaner.flush() == "y"
+    print("✅ Text after an unpaired apostrophe held back until it was paired or flushed")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing streaming text cleanup...")
+    test_every_split_matches_one_shot()
+    test_character_stream_matches_one_shot()
+    test_open_markup_is_held_back()
+    test_plain_text_is_released()
+    test_unpaired_apostrophe_holds_back_the_rest()
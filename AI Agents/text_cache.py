@@ -0,0 +1,139 @@
+"""
+Cache of extracted PDF text keyed by the PDF's SHA-256.
+
+PyPDF2 parsing is the most CPU-heavy local step, and its output only depends
+on the file bytes and the parser, so re-scoring a document with new prompts or
+models should never parse it again. Each entry holds the zlib-compressed page
+texts, the page offsets within the joined text, the parser version and
+whether every page was parsed (extraction may stop early at a character
+budget). Entries are evicted least recently used first once the compressed
+total passes the size cap. IPFS hashes are linked to the digests they resolved
+to so a bulk re-score can run from this cache alone.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Pages are joined with this separator, as in pdf_text.extract_text
+PAGE_SEPARATOR = " "
+
+
+class CachedText:
+    def __init__(self, pages, complete):
+        self.pages = pages
+        self.complete = complete
+        self.text = PAGE_SEPARATOR.join(pages)
+
+    @property
+    def page_offsets(self):
+        """Start index of each page within text"""
+        offsets, position = [], 0
+        for page in self.pages:
+            offsets.append(position)
+            position += len(page) + len(PAGE_SEPARATOR)
+        return offsets
+
+
+class TextCache:
+    """SQLite-backed, size-capped store of extracted PDF text"""
+
+    def __init__(self, db_path: str, max_bytes: int, parser_version: str):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.parser_version = parser_version
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS texts (
+                    sha256 TEXT PRIMARY KEY,
+                    parser_version TEXT NOT NULL,
+                    pages BLOB NOT NULL,
+                    page_offsets TEXT NOT NULL,
+                    chars INTEGER NOT NULL,
+                    complete INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    ipfs_hash TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL
+                )
+                """
+            )
+            # Text from an older parser may differ, so it is never served
+            conn.execute("DELETE FROM texts WHERE parser_version != ?", (parser_version,))
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, sha256: str, max_chars: int = None):
+        """Cached text for sha256 covering at least max_chars characters (or all pages), else None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT pages, chars, complete FROM texts WHERE sha256 = ? AND parser_version = ?",
+                (sha256, self.parser_version),
+            ).fetchone()
+            if row is None:
+                return None
+            pages, chars, complete = row
+            if not complete and (max_chars is None or chars < max_chars):
+                return None
+            conn.execute("UPDATE texts SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+        return CachedText(json.loads(zlib.decompress(pages).decode("utf-8")), bool(complete))
+
+    def put(self, sha256: str, pages, complete: bool):
+        entry = CachedText(pages, complete)
+        blob = zlib.compress(json.dumps(pages).encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            # Never replace a complete entry with a partial one
+            existing = conn.execute("SELECT complete, chars FROM texts WHERE sha256 = ?", (sha256,)).fetchone()
+            if existing and (existing[0] or existing[1] >= len(entry.text)) and not complete:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    sha256, self.parser_version, blob, json.dumps(entry.page_offsets),
+                    len(entry.text), int(complete), len(blob), time.time(),
+                ),
+            )
+            self._evict(conn)
+
+    def link(self, ipfs_hash: str, sha256: str):
+        """Record which PDF digest an IPFS hash resolved to"""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?)", (ipfs_hash, sha256))
+
+    def documents(self):
+        """(ipfs_hash, sha256) pairs whose text is cached"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT d.ipfs_hash, d.sha256 FROM documents d JOIN texts t ON t.sha256 = d.sha256 ORDER BY d.ipfs_hash"
+            ).fetchall()
+
+    def _evict(self, conn):
+        """Drop least recently used entries until the compressed total fits in max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for sha256, size in conn.execute("SELECT sha256, size FROM texts ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM texts WHERE sha256 = ?", (sha256,))
+            total -= size
@@ -0,0 +1,174 @@
+"""
+Plain-text cleanup for model output (PDF summaries and chat replies).
+
+clean_text_formatting strips markdown, quotes and escape sequences and
+normalizes whitespace. The rewrite rules are order-dependent (bold markers
+must go before italic ones, quotes before escaped quotes, list numbering
+before whitespace collapsing), so they run as a fixed sequence of passes. All
+patterns are compiled once at import, the four escape-sequence replacements
+share one pass, and any pass whose trigger character does not occur in the
+text is skipped without scanning it with a regex. StreamingCleaner applies
+the same cleanup incrementally to streamed text and produces exactly the same
+output.
+"""
+
+import operator
+import re
+
+# Literal backslash escapes the model sometimes emits: \n -> newline, \t -> space, \r -> removed
+ESCAPES = {'n': '\n', 't': ' ', 'r': ''}
+ESCAPE_PATTERN = re.compile(r'\\([ntr])')
+
+BOLD_STAR = re.compile(r'\*\*(.*?)\*\*')
+BOLD_UNDERSCORE = re.compile(r'__(.*?)__')
+ITALIC_STAR = re.compile(r'\*(.*?)\*')
+ITALIC_UNDERSCORE = re.compile(r'_(.*?)_')
+CODE_BLOCK = re.compile(r'```.*?```', re.DOTALL)
+INLINE_CODE = re.compile(r'`(.*?)`')
+DOUBLE_QUOTED = re.compile(r'"([^"]*)"')
+SINGLE_QUOTED = re.compile(r"'([^']*)'")
+ESCAPED_MARKUP = re.compile(r'\\([*_`"\'])')
+NUMBERED_ITEM = re.compile(r'\n\n(\d+)[:\s]*')
+EXTRA_NEWLINES = re.compile(r'\n{3,}')
+BLANK_LINE_SPACES = re.compile(r'\n\s+\n')
+REPEATED_SPACES = re.compile(r'[ \t]{2,}')
+SPACE_BEFORE_PUNCTUATION = re.compile(r'\s+([.,:;!?])')
+SPACES_AFTER_PUNCTUATION = re.compile(r'([.,:;!?])\s{2,}')
+
+# Replacement for passes that keep the delimited text; unlike an r'\1' template
+# it doesn't run Python code per match
+KEEP_INNER = operator.methodcaller('group', 1)
+
+# Markup removed by pairing delimiters, in order: (trigger, pattern, replacement,
+# opening delimiter, whether a pair can span lines). An opening delimiter left
+# unpaired may still pair with text that has not arrived yet.
+PAIRED_MARKUP = [
+    ('*', BOLD_STAR, KEEP_INNER, re.compile(r'(?=\*\*)'), False),
+    ('__', BOLD_UNDERSCORE, KEEP_INNER, re.compile(r'(?=__)'), False),
+    ('*', ITALIC_STAR, KEEP_INNER, re.compile(r'\*'), False),
+    ('_', ITALIC_UNDERSCORE, KEEP_INNER, re.compile(r'_'), False),
+    ('```', CODE_BLOCK, '', re.compile(r'(?=```)'), True),
+    ('`', INLINE_CODE, KEEP_INNER, re.compile(r'`'), False),
+    ('"', DOUBLE_QUOTED, KEEP_INNER, re.compile(r'"'), True),
+    ("'", SINGLE_QUOTED, KEEP_INNER, re.compile(r"'"), True),
+]
+
+# Characters that can open or close markup, or end a line
+MARKUP_CHARS = '*_`"\'\\\n'
+
+
+def _unescape(match):
+    return ESCAPES[match.group(1)]
+
+
+def clean_text_formatting(text):
+    """Remove all markdown and special formatting from text"""
+    # Escape sequences (\n, \t, \r written out literally)
+    if '\\' in text:
+        text = ESCAPE_PATTERN.sub(_unescape, text)
+
+    # Markdown bold (**text**, __text__) and italic (*text*, _text_), code
+    # blocks, inline code and extra quotes
+    for trigger, pattern, replacement, _, _ in PAIRED_MARKUP:
+        if trigger in text:
+            text = pattern.sub(replacement, text)
+
+    # Escaped formatting characters
+    if '\\' in text:
+        text = ESCAPED_MARKUP.sub(KEEP_INNER, text)
+
+    if '\n' in text:
+        # Numbered lists: \n\n1 and \n\n1: become \n\n1.
+        if '\n\n' in text:
+            text = NUMBERED_ITEM.sub(r'\n\n\1. ', text)
+            if '\n\n\n' in text:
+                text = EXTRA_NEWLINES.sub('\n\n', text)
+        text = BLANK_LINE_SPACES.sub('\n\n', text)
+
+    # Multiple spaces/tabs to single
+    if '  ' in text or '\t' in text:
+        text = REPEATED_SPACES.sub(' ', text)
+
+    # Spacing around punctuation
+    text = SPACE_BEFORE_PUNCTUATION.sub(KEEP_INNER, text)
+    text = SPACES_AFTER_PUNCTUATION.sub(r'\1 ', text)
+
+    return text.strip()
+
+
+def _has_open_markup(text):
+    """Whether some markup in text is still waiting for a closing delimiter
+
+    If not, and text ends between two letters, nothing in it can pair with
+    text that follows, so it cleans the same on its own as within the whole reply.
+    """
+    if '\\' in text:
+        text = ESCAPE_PATTERN.sub(_unescape, text)
+    for trigger, pattern, replacement, opener, multiline in PAIRED_MARKUP:
+        if trigger not in text:
+            continue
+        # Openers on earlier lines are settled for markup that stays within a line
+        start = 0 if multiline else text.rfind('\n') + 1
+        paired = [match.span() for match in pattern.finditer(text, start)]
+        for match in opener.finditer(text, start):
+            if not any(begin <= match.start() < end for begin, end in paired):
+                return True
+        text = pattern.sub(replacement, text)
+    return False
+
+
+class StreamingCleaner:
+    """Applies clean_text_formatting to streamed text as it arrives
+
+    Text is released up to the last point between two letters where no markup
+    is open (an unpaired "**", "_", backtick, code fence or quote), and cleaned
+    on its own. Only the tail after that point is held back, and the
+    concatenated pieces equal clean_text_formatting of the whole reply.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+
+    def _cut_points(self, end):
+        """Positions before end that fall between two letters, latest first"""
+        text = self.buffer
+        for cut in range(end - 1, 0, -1):
+            # A letter after a backslash is an escape sequence (\n), not text
+            if text[cut].isalpha() and text[cut - 1].isalpha() and text[cut - 2:cut - 1] != '\\':
+                yield cut
+
+    def _last_markup(self, end):
+        return max(self.buffer.rfind(char, 0, end) for char in MARKUP_CHARS)
+
+    def _safe_cut(self, new_from):
+        """End of the longest prefix of the buffer that can be cleaned on its own, or 0
+
+        Plain text between two markup characters doesn't change whether a prefix
+        is safe, so one cut point per run of plain text is checked, and runs
+        before the new text were already found unsafe by the previous feed().
+        """
+        checked = self._last_markup(new_from)
+        end = len(self.buffer)
+        while end > checked:
+            cut = next(self._cut_points(end), 0)
+            if cut <= checked:
+                return 0
+            if not _has_open_markup(self.buffer[:cut]):
+                return cut
+            end = self._last_markup(cut)
+        return 0
+
+    def feed(self, chunk):
+        """Add a streamed chunk; return the cleaned text that is now safe to show"""
+        new_from = len(self.buffer)
+        self.buffer += chunk
+        cut = self._safe_cut(new_from)
+        if not cut:
+            return ''
+        segment, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return clean_text_formatting(segment)
+
+    def flush(self):
+        """Clean and return whatever is left once the stream has ended"""
+        segment, self.buffer = self.buffer, ''
+        return clean_text_formatting(segment)
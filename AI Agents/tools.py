@@ -1,69 +1,461 @@
-import requests
-from PyPDF2 import PdfReader
 import re
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+import functools
+import hashlib
+import json
+import llm
+import pdf_text
+from concurrent.futures import ThreadPoolExecutor
+from pdf_cache import PdfCache, file_sha256
+from ipfs_fetch import AsyncGatewayFetcher, GatewayFetcher, create_session, gateways_from_env
+from result_store import ResultStore
+from text_cache import TextCache
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# Each LLM call sees at most this many characters of a document
+TEXT_LIMIT = 8000
 
-# Try different model names in order of preference
-model_names = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-pro", "models/gemini-1.5-flash"]
-model = None
+# Longer documents are analyzed in at most ANALYSIS_MAX_CHUNKS chunks, with
+# ANALYSIS_CHUNK_CONCURRENCY calls in flight per document. By default the cap
+# is what the rate limiter's bulk burst admits at once, less one call for the
+# reduce step, so a document doesn't wait for quota (7 at 60 requests per
+# minute). Chunks are TEXT_LIMIT characters, or larger up to
+# ANALYSIS_CHUNK_MAX_CHARS when that is what it takes to fit the cap
+# (ANALYSIS_MAX_CHUNKS=1 analyzes only the first TEXT_LIMIT characters)
+_BURST_CHUNKS = min(16, llm.limiter.bulk_burst() - 1) if llm.limiter else 16
+MAX_CHUNKS = max(1, int(os.getenv("ANALYSIS_MAX_CHUNKS", str(_BURST_CHUNKS))))
+CHUNK_CONCURRENCY = max(1, int(os.getenv("ANALYSIS_CHUNK_CONCURRENCY", str(MAX_CHUNKS))))
+CHUNK_MAX_CHARS = max(TEXT_LIMIT, int(os.getenv("ANALYSIS_CHUNK_MAX_CHARS", "32000")))
 
-for model_name in model_names:
-    try:
-        model = genai.GenerativeModel(model_name)
-        # Test the model with a simple request
-        test_response = model.generate_content("Hello")
-        print(f"Successfully using model: {model_name}")
-        break
-    except Exception as e:
-        print(f"Model {model_name} failed: {str(e)[:100]}...")
-        continue
-
-if model is None:
-    raise Exception("No working Gemini model found. Please check your API key and try running 'python list_models.py' to see available models.")
-
-def download_pdf_from_ipfs(ipfs_hash: str) -> str:
-    """Download PDF from IPFS using public gateway"""
-    # Use public IPFS gateway
-    gateway_url = f"https://ipfs.io/ipfs/{ipfs_hash}"
-    
-    try:
-        response = requests.get(gateway_url, timeout=30)
-        response.raise_for_status()
-        
-        # Save to local file
-        file_path = f"{ipfs_hash}.pdf"
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
-        
-        return file_path
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Failed to download PDF from IPFS: {e}")
-
-def extract_text_from_pdf(file_path: str) -> str:
-    reader = PdfReader(file_path)
-    text = " ".join(page.extract_text() or "" for page in reader.pages)
-    return text
+# Characters of a document that are extracted for analysis
+ANALYSIS_MAX_CHARS = CHUNK_MAX_CHARS * MAX_CHUNKS
 
-def summarize_text(text: str) -> str:
-    prompt = f"Summarize the following PDF content:\n\n{text[:8000]}"
-    response = model.generate_content(prompt)
-    return response.text.strip()
+SUMMARY_PROMPT = "Summarize the following PDF content:\n\n{text}"
 
-def score_pdf_content(text: str) -> float:
-    prompt = f"""
+SCORE_PROMPT = """
     Analyze the following document and give a score between 0 and 10 for how genuine it seems. 
     Consider whether it's a proper invoice, has dates, formatting, signatures, or official tone.
     Output ONLY the score:
     
-    {text[:8000]}
+    {text}
+    """
+
+# Summary and score in a single call with structured output
+ANALYSIS_PROMPT = """
+    Analyze the following PDF content. Summarize it, and give a score between 0 and 10 for how genuine it seems.
+    Consider whether it's a proper invoice, has dates, formatting, signatures, or official tone.
+    Respond with JSON only, in exactly this form:
+    {{"summary": "<summary of the document>", "score": <number between 0 and 10>}}
+
+    {text}
     """
-    response = model.generate_content(prompt)
+
+# Map step for one chunk of a long document
+CHUNK_PROMPT = """
+    The following is part {index} of {count} of a PDF document. Summarize this part, and give a score between 0 and 10
+    for how genuine it seems. Judge only what this part shows: whether it reads like part of a proper invoice or
+    official document, with consistent dates, amounts, formatting, signatures or official tone. A single part
+    need not contain every element of the whole document.
+    Respond with JSON only, in exactly this form:
+    {{"summary": "<summary of this part>", "score": <number between 0 and 10>}}
+
+    {text}
+    """
+
+# Reduce step merging the chunk results into one analysis
+REDUCE_PROMPT = """
+    Below are the summaries and genuineness scores (0 to 10) of the {count} consecutive parts of one PDF document.
+    Write one summary of the whole document, and give an overall score between 0 and 10 for how genuine it seems.
+    A part with a low score, or parts that contradict each other, should lower the overall score.
+    Respond with JSON only, in exactly this form:
+    {{"summary": "<summary of the document>", "score": <number between 0 and 10>}}
+
+    {parts}
+    """
+
+JSON_MODE = {"response_mime_type": "application/json"}
+
+# Changes whenever a prompt does, so stored results from older prompts stop matching
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join([
+        SUMMARY_PROMPT, SCORE_PROMPT, ANALYSIS_PROMPT, CHUNK_PROMPT, REDUCE_PROMPT,
+        str(TEXT_LIMIT), str(MAX_CHUNKS), str(CHUNK_MAX_CHARS),
+    ]).encode()
+).hexdigest()[:16]
+
+# The separate summary and score prompts only read the first TEXT_LIMIT characters,
+# so their results are stored under their own version and never answer a full analysis
+SEPARATE_PROMPT_VERSION = hashlib.sha256(
+    "\0".join(["separate", SUMMARY_PROMPT, SCORE_PROMPT, str(TEXT_LIMIT)]).encode()
+).hexdigest()[:16]
+
+# Downloaded PDFs are cached by CID, so a repeat analysis needs no network I/O
+pdf_cache = PdfCache(
+    os.getenv("PDF_CACHE_DIR", "pdf_cache"),
+    int(os.getenv("PDF_CACHE_MAX_MB", "500")) * 1024 * 1024,
+)
+
+# One pooled keep-alive session for all gateway I/O, with retries on transient errors
+http_session = create_session(
+    pool_size=int(os.getenv("IPFS_POOL_SIZE", "10")),
+    retries=int(os.getenv("IPFS_RETRIES", "3")),
+    backoff_factor=float(os.getenv("IPFS_BACKOFF", "0.5")),
+)
+
+# Races the configured gateways and streams the first good response to disk
+fetcher = GatewayFetcher(
+    gateways_from_env(),
+    max_bytes=int(os.getenv("IPFS_MAX_MB", "50")) * 1024 * 1024,
+    race_width=int(os.getenv("IPFS_RACE_WIDTH", "3")),
+    timeout=float(os.getenv("IPFS_TIMEOUT", "30")),
+    session=http_session,
+)
+
+# The same race on the event loop for the ASGI server; needs httpx, otherwise
+# async downloads run the threaded fetcher on an executor thread
+try:
+    async_fetcher = AsyncGatewayFetcher(
+        fetcher,
+        pool_size=int(os.getenv("IPFS_POOL_SIZE", "10")),
+        retries=int(os.getenv("IPFS_RETRIES", "3")),
+        backoff_factor=float(os.getenv("IPFS_BACKOFF", "0.5")),
+    )
+except ImportError:
+    async_fetcher = None
+
+# Analysis results keyed by (CID, model, prompt version); servers and the CLI call
+# prune_results() once at startup
+result_store = ResultStore(os.getenv("RESULT_STORE_PATH", "results.db"))
+
+# Extracted text keyed by PDF SHA-256, so re-scoring never re-parses a document
+text_cache = TextCache(
+    os.getenv("TEXT_CACHE_PATH", "text_cache.db"),
+    int(os.getenv("TEXT_CACHE_MAX_MB", "200")) * 1024 * 1024,
+    pdf_text.PARSER_VERSION,
+)
+
+def _run_blocking(func, *args):
+    """Run func on the event loop's executor, for cache, SQLite and PDF parsing work in async code"""
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+def _link_text(ipfs_hash: str):
+    # Remember which document this hash is, for re-scoring from cached text
+    text_cache.link(ipfs_hash, pdf_cache.digest(ipfs_hash))
+
+def download_pdf_from_ipfs(ipfs_hash: str) -> str:
+    """Download PDF from IPFS using public gateways, reusing the local cache when possible"""
+    file_path = pdf_cache.get(ipfs_hash)
+    if not file_path:
+        # Stream from the fastest gateway straight into the cache directory
+        tmp_path = fetcher.fetch(ipfs_hash, pdf_cache.cache_dir)
+        file_path = pdf_cache.commit(ipfs_hash, tmp_path)
+
+    _link_text(ipfs_hash)
+    return file_path
+
+async def adownload_pdf_from_ipfs(ipfs_hash: str) -> str:
+    """download_pdf_from_ipfs() for asyncio callers"""
+    file_path = await _run_blocking(pdf_cache.get, ipfs_hash)
+    if not file_path:
+        if async_fetcher:
+            tmp_path = await async_fetcher.fetch(ipfs_hash, pdf_cache.cache_dir)
+        else:
+            tmp_path = await _run_blocking(fetcher.fetch, ipfs_hash, pdf_cache.cache_dir)
+        file_path = await _run_blocking(pdf_cache.commit, ipfs_hash, tmp_path)
+
+    await _run_blocking(_link_text, ipfs_hash)
+    return file_path
+
+def extract_pages_from_pdf(file_path: str, max_chars: int = None) -> list:
+    """Extract page texts, parsing only as many pages as needed to fill max_chars"""
+    digest = file_sha256(file_path)
+    cached = text_cache.get(digest, max_chars)
+    if cached:
+        return cached.pages
+    pages, complete = pdf_text.extract_pages(file_path, max_chars=max_chars)
+    text_cache.put(digest, pages, complete)
+    return pages
+
+def extract_text_from_pdf(file_path: str, max_chars: int = None) -> str:
+    """Extract text, parsing only as many pages as needed to fill max_chars"""
+    text = " ".join(extract_pages_from_pdf(file_path, max_chars))
+    return text if max_chars is None else text[:max_chars]
+
+async def aextract_pages_from_pdf(file_path: str, max_chars: int = None) -> list:
+    """extract_pages_from_pdf() on an executor thread, so parsing doesn't block the event loop"""
+    return await _run_blocking(extract_pages_from_pdf, file_path, max_chars)
+
+async def aextract_text_from_pdf(file_path: str, max_chars: int = None) -> str:
+    """extract_text_from_pdf() on an executor thread, so parsing doesn't block the event loop"""
+    return await _run_blocking(extract_text_from_pdf, file_path, max_chars)
+
+def answered_by(*model_names) -> str:
+    """Model a result is stored under: of several contributing models, the least preferred"""
+    order = llm.registry.model_names
+    return max(model_names, key=lambda name: order.index(name) if name in order else len(order))
+
+def summarize_with_model(text: str):
+    """Summary of text and the model that wrote it"""
+    prompt = SUMMARY_PROMPT.format(text=text[:TEXT_LIMIT])
+    return llm.generate_with_model(prompt, lane="bulk")
+
+async def asummarize_with_model(text: str):
+    prompt = SUMMARY_PROMPT.format(text=text[:TEXT_LIMIT])
+    return await llm.agenerate_with_model(prompt, lane="bulk")
+
+def summarize_text(text: str) -> str:
+    return summarize_with_model(text)[0]
+
+async def asummarize_text(text: str) -> str:
+    return (await asummarize_with_model(text))[0]
+
+def score_with_model(text: str):
+    """Genuineness score of text and the model that gave it"""
+    prompt = SCORE_PROMPT.format(text=text[:TEXT_LIMIT])
+    response_text, model_name = llm.generate_with_model(prompt, lane="bulk")
+    # A reply without a usable score is an error, never a made-up middle score
+    return parse_score(response_text), model_name
+
+async def ascore_with_model(text: str):
+    prompt = SCORE_PROMPT.format(text=text[:TEXT_LIMIT])
+    response_text, model_name = await llm.agenerate_with_model(prompt, lane="bulk")
+    return parse_score(response_text), model_name
+
+def score_pdf_content(text: str) -> float:
+    return score_with_model(text)[0]
+
+async def ascore_pdf_content(text: str) -> float:
+    return (await ascore_with_model(text))[0]
+
+def parse_score(value) -> float:
+    """Read a 0-10 score from a number or the first number in a string"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid score: {value!r}")
+    if isinstance(value, (int, float)):
+        score = float(value)
+    else:
+        match = re.search(r'\d+(?:\.\d+)?', str(value))
+        if not match:
+            raise ValueError(f"No score found in: {str(value)[:100]!r}")
+        score = float(match.group(0))
+    if not 0 <= score <= 10:
+        raise ValueError(f"Score out of range: {score}")
+    return score
+
+def parse_analysis(response_text: str) -> dict:
+    """Validate the JSON reply of ANALYSIS_PROMPT and return {"summary", "score"}"""
+    # Tolerate a ```json fenced reply from models without JSON mode
+    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', response_text.strip())
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Analysis is not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Analysis JSON must be an object")
+
+    summary = data.get("summary")
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError("Analysis is missing a summary")
+    return {"summary": summary.strip(), "score": parse_score(data.get("score"))}
+
+def analyze_text(text: str) -> dict:
+    """Summarize and score text with one structured LLM call
+
+    Returns {"summary", "score", "model"}, where model is the model that answered.
+    Raises ValueError if the reply fails validation, so no result is stored.
+    """
+    prompt = ANALYSIS_PROMPT.format(text=text[:TEXT_LIMIT])
+    response_text, model_name = llm.generate_with_model(prompt, lane="bulk", generation_config=JSON_MODE)
+    return dict(parse_analysis(response_text), model=model_name)
+
+async def aanalyze_text(text: str) -> dict:
+    """analyze_text() for asyncio callers"""
+    prompt = ANALYSIS_PROMPT.format(text=text[:TEXT_LIMIT])
+    response_text, model_name = await llm.agenerate_with_model(prompt, lane="bulk", generation_config=JSON_MODE)
+    return dict(parse_analysis(response_text), model=model_name)
+
+def _split_long(text: str, max_chars: int) -> list:
+    """Split text into pieces of at most max_chars, cutting at a paragraph, line, sentence or word break"""
+    pieces = []
+    while len(text) > max_chars:
+        window = text[:max_chars]
+        for separator in ("\n\n", "\n", ". ", " "):
+            cut = window.rfind(separator)
+            # Don't accept a break so early that the piece is mostly wasted
+            if cut > max_chars // 2:
+                cut += len(separator)
+                break
+        else:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text.strip():
+        pieces.append(text)
+    return pieces
+
+def split_into_chunks(pages: list, max_chars: int = TEXT_LIMIT) -> list:
+    """Split page texts into chunks of at most max_chars, preferring page and paragraph breaks
+
+    The pages are cut as one text, so the tail of a page that didn't fit
+    fills up the same chunk as the pages after it.
+    """
+    text = "\n\n".join(page.strip() for page in pages if page.strip())
+    return _split_long(text, max_chars)
+
+def _document_chunks(pages: list) -> list:
+    """Chunks of TEXT_LIMIT characters, grown up to CHUNK_MAX_CHARS until the document fits in MAX_CHUNKS"""
+    size = TEXT_LIMIT
+    chunks = split_into_chunks(pages, size)
+    while len(chunks) > MAX_CHUNKS > 1 and size < CHUNK_MAX_CHARS:
+        total = sum(len(chunk) for chunk in chunks)
+        # Breaks land short of the limit, so aim a little above an even split
+        size = min(CHUNK_MAX_CHARS, max(size + size // 10, -(-total * 11 // (10 * MAX_CHUNKS))))
+        chunks = split_into_chunks(pages, size)
+    if len(chunks) > MAX_CHUNKS:
+        print(f"Document is longer than {MAX_CHUNKS} chunks; only the first {MAX_CHUNKS} are analyzed")
+        chunks = chunks[:MAX_CHUNKS]
+    return chunks
+
+def _chunk_analysis(response_text: str, model_name: str, index: int, count: int):
+    """Parsed chunk analysis; a rejected reply fails the whole document, so a partial result isn't stored"""
+    try:
+        return dict(parse_analysis(response_text), model=model_name)
+    except ValueError as e:
+        raise ValueError(f"Analysis of chunk {index}/{count} rejected: {e}")
+
+def analyze_chunk(chunk: str, index: int, count: int) -> dict:
+    """Map step: summarize and score one chunk of a long document"""
+    prompt = CHUNK_PROMPT.format(index=index, count=count, text=chunk)
+    response_text, model_name = llm.generate_with_model(prompt, lane="bulk", generation_config=JSON_MODE)
+    return _chunk_analysis(response_text, model_name, index, count)
+
+async def aanalyze_chunk(chunk: str, index: int, count: int) -> dict:
+    prompt = CHUNK_PROMPT.format(index=index, count=count, text=chunk)
+    response_text, model_name = await llm.agenerate_with_model(prompt, lane="bulk", generation_config=JSON_MODE)
+    return _chunk_analysis(response_text, model_name, index, count)
+
+def merge_analyses(parts: list, chunks: list) -> dict:
+    """Fallback reduce step: chunk summaries in order and the length-weighted mean score"""
+    total = sum(len(chunk) for chunk in chunks) or 1
+    score = sum(part["score"] * len(chunk) for part, chunk in zip(parts, chunks)) / total
+    return {"summary": " ".join(part["summary"] for part in parts), "score": round(score, 1)}
+
+def _reduce_prompt(parts: list) -> str:
+    listed = "\n".join(f"Part {index} (score {part['score']}): {part['summary']}" for index, part in enumerate(parts, 1))
+    return REDUCE_PROMPT.format(count=len(parts), parts=listed)
+
+def _reduced_analysis(response_text: str, model_name: str, parts: list, chunks: list) -> dict:
+    models = [part["model"] for part in parts]
     try:
-        return float(re.findall(r'\d+(\.\d+)?', response.text)[0])
-    except:
-        return 5.0  # Default fallback
+        result = parse_analysis(response_text)
+        models.append(model_name)
+    except ValueError as e:
+        print(f"Merged analysis rejected ({e}); combining chunk results")
+        result = merge_analyses(parts, chunks)
+    return dict(result, model=answered_by(*models))
+
+def analyze_document(pages: list) -> dict:
+    """Summarize and score a document's pages
+
+    Documents that fit in TEXT_LIMIT characters take one analyze_text() call.
+    Longer ones are split into at most MAX_CHUNKS chunks that are analyzed
+    concurrently, and one more call merges the chunk results. "model" in the
+    result is the model to store it under (see answered_by()).
+    """
+    chunks = _document_chunks(pages)
+    if len(chunks) <= 1:
+        return analyze_text(chunks[0] if chunks else "")
+
+    def analyze(numbered):
+        index, chunk = numbered
+        return analyze_chunk(chunk, index, len(chunks))
+
+    with ThreadPoolExecutor(max_workers=min(CHUNK_CONCURRENCY, len(chunks))) as executor:
+        parts = list(executor.map(analyze, enumerate(chunks, 1)))
+    response_text, model_name = llm.generate_with_model(_reduce_prompt(parts), lane="bulk", generation_config=JSON_MODE)
+    return _reduced_analysis(response_text, model_name, parts, chunks)
+
+async def aanalyze_document(pages: list) -> dict:
+    """analyze_document() for asyncio callers"""
+    chunks = _document_chunks(pages)
+    if len(chunks) <= 1:
+        return await aanalyze_text(chunks[0] if chunks else "")
+
+    slots = asyncio.Semaphore(min(CHUNK_CONCURRENCY, len(chunks)))
+
+    async def analyze(index, chunk):
+        async with slots:
+            return await aanalyze_chunk(chunk, index, len(chunks))
+
+    parts = await asyncio.gather(*[analyze(index, chunk) for index, chunk in enumerate(chunks, 1)])
+    response_text, model_name = await llm.agenerate_with_model(_reduce_prompt(parts), lane="bulk",
+                                                               generation_config=JSON_MODE)
+    return _reduced_analysis(response_text, model_name, parts, chunks)
+
+def prune_results() -> int:
+    """Delete stored results from older prompt versions; returns the number removed"""
+    removed = result_store.prune([PROMPT_VERSION, SEPARATE_PROMPT_VERSION])
+    if removed:
+        print(f"Pruned {removed} stored result(s) from older prompts")
+    return removed
+
+def _prompt_version(combined: bool) -> str:
+    return PROMPT_VERSION if combined else SEPARATE_PROMPT_VERSION
+
+def get_cached_result(ipfs_hash: str, combined: bool = True):
+    """Stored analysis for ipfs_hash under the current prompts, or None
+
+    The configured primary model's result is looked up first. A result from a
+    fallback model only counts while the router prefers that model itself (the
+    models ahead of it have open breakers), so a weaker model's answer is never
+    served in place of the one a fresh analysis would give.
+    """
+    names = llm.registry.model_names
+    preferred = names[:names.index(llm.registry.model_name) + 1]
+    return result_store.get_first(ipfs_hash, preferred, _prompt_version(combined))
+
+def cache_result(ipfs_hash: str, result: dict, model_name: str, combined: bool = True):
+    """Remember an analysis under the model that produced it and the current prompts"""
+    result_store.put(ipfs_hash, model_name, _prompt_version(combined), result)
+
+async def aget_cached_result(ipfs_hash: str, combined: bool = True):
+    return await _run_blocking(get_cached_result, ipfs_hash, combined)
+
+async def acache_result(ipfs_hash: str, result: dict, model_name: str, combined: bool = True):
+    await _run_blocking(cache_result, ipfs_hash, result, model_name, combined)
+
+def rescore_cached_documents(force: bool = False, workers: int = 4):
+    """Re-analyze every document with cached text using the current model and prompts
+
+    Reads text from the text cache without downloading anything. Text that was
+    extracted with a smaller budget than ANALYSIS_MAX_CHARS is re-extracted
+    from the PDF cache, and the document is skipped if the PDF is gone, so a
+    stored result always covers as much of the document as a fresh analysis.
+    Documents that already have a result for the current prompts are skipped
+    unless force is set. Returns (rescored, failed) counts.
+    """
+    def rescore(document):
+        ipfs_hash, digest = document
+        if not force and get_cached_result(ipfs_hash):
+            return None
+        cached = text_cache.get(digest, ANALYSIS_MAX_CHARS)
+        try:
+            if cached:
+                pages = cached.pages
+            else:
+                file_path = pdf_cache.get(ipfs_hash)
+                if not file_path:
+                    print(f"Skipped {ipfs_hash}: cached text is partial and the PDF is no longer cached")
+                    return None
+                pages = extract_pages_from_pdf(file_path, ANALYSIS_MAX_CHARS)
+            result = analyze_document(pages)
+            cache_result(ipfs_hash, result, result.pop("model"))
+            print(f"Re-scored {ipfs_hash}")
+            return True
+        except Exception as e:
+            print(f"Failed to re-score {ipfs_hash}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(rescore, text_cache.documents()))
+    return outcomes.count(True), outcomes.count(False)